@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# Agent controlling Jormungandr runners on a host for the jorm_master running elsewhere
+#
+# Systemd actions and storage operations are requested over HTTP, states of all units are returned by a single
+# request. The agent shares jorm_master.py and its configuration file with the master.
+
+import argparse
+import hmac
+import ipaddress
+import json
+import logging
+import signal
+import sys
+from time import monotonic
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from urllib.parse import urlsplit, parse_qs
+
+import jorm_master as jm
+
+logger = logging.getLogger('jorm_agent')
+logger.addHandler(jm.log_handler)
+logger.setLevel(logging.INFO)
+
+
+class Agent:
+    """Systemd actions and storage operations on the runners of this host
+
+    Only the given runner ids can be controlled, requests have to carry the token if it is set.
+    """
+    def __init__(self, ids, systemd=None, token=None):
+        self.ids = set(ids)
+        self.__host = jm.LocalHost(systemd or jm.systemd_backend())
+        self.__token = token
+
+    def __id(self, value):
+        id = int(value)
+        if id not in self.ids:
+            raise KeyError(f'Jormungandr runner {id} is not controlled by this agent')
+        return id
+
+    def request(self, method, path, body, auth):
+        """Handle a request, return tuple (HTTP code, JSON payload)
+        """
+        if self.__token and not hmac.compare_digest(auth or '', f'Bearer {self.__token}'):
+            return 401, {'error': 'unauthorized'}
+
+        url = urlsplit(path)
+        parts = url.path.strip('/').split('/')
+        try:
+            if method == 'GET' and parts == ['units']:
+                ids = [self.__id(id) for id in parse_qs(url.query).get('ids', [''])[0].split(',') if id]
+                now = monotonic()
+                # uptime instead of the start time, as monotonic clocks of the hosts differ
+                return 200, {str(id): [u.state, now - u.since if u.since else 0]
+                             for id, u in self.__host.units(ids).items()}
+
+            if method != 'POST' or len(parts) != 3 or parts[0] not in ['units', 'storage']:
+                return 404, {'error': 'not found'}
+            id = self.__id(parts[1])
+            action = tuple(parts[::2])
+            if action == ('units', 'restart'):
+                logger.info(f'Restarting Jormungandr runner {id}')
+                self.__host.restart(id)
+            elif action == ('units', 'stop'):
+                logger.info(f'Stopping Jormungandr runner {id}')
+                self.__host.stop(id)
+            elif action == ('units', 'kill'):
+                sig = signal.Signals(int(body['signal']))
+                logger.info(f'Sending {sig.name} to Jormungandr runner {id}')
+                self.__host.kill(id, sig)
+            elif action == ('storage', 'copy'):
+                src = self.__id(body['src'])
+                logger.info(f'Copying storage of Jormungandr runner {src} to runner {id}')
+                self.__host.copy_storage(src, id, monotonic() + float(body['seconds']))
+            elif action == ('storage', 'swap'):
+                self.__host.swap_storage(id)
+            elif action == ('storage', 'discard'):
+                self.__host.discard_storage_copy(id)
+            else:
+                return 404, {'error': 'not found'}
+            return 200, {}
+        except (KeyError, ValueError, TypeError) as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            logger.error(f'Request {method} {path} failed: {e}')
+            return 500, {'error': str(e)}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def __handle(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length)) if length else {}
+        except ValueError:
+            body = None
+        code, payload = self.server.agent.request(method, self.path, body, self.headers.get('Authorization'))
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.__handle('GET')
+
+    def do_POST(self):
+        self.__handle('POST')
+
+
+def serve(agent, host, port, background=False):
+    """Serve the agent on host:port, in a background thread if requested, return the server
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.agent = agent
+    if background:
+        Thread(target=server.serve_forever, name=f'jorm_agent_{port}', daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+# exit status on a configuration error, jorm_agent.service doesn't restart the agent on it
+EX_CONFIG = 78
+
+
+def loopback(host):
+    """Is the listen address reachable only from this host?
+    """
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Control Jormungandr runners of this host for jorm_master')
+    parser.add_argument('--listen', default=jm.config.get('agent_listen', '127.0.0.1:9320'),
+                        help='address to listen on, host:port')
+    parser.add_argument('--runners', type=int, nargs='+', required=True, help='ids of the runners on this host')
+    args = parser.parse_args()
+
+    host, port = args.listen.rsplit(':', 1)
+    token = jm.config.get('agent_token')
+    if not token and not loopback(host.strip('[]')):
+        # anyone on the network could stop the runners or overwrite their storage
+        logger.error(f'Refusing to listen on {args.listen} without agent_token in the config')
+        sys.exit(EX_CONFIG)
+    logger.info(f'Controlling Jormungandr runners {args.runners} on {args.listen}')
+    serve(Agent(args.runners, token=token), host, int(port))
+
+
+if __name__ == '__main__':
+    main()
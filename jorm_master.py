@@ -7,34 +7,111 @@
 import requests
 import logging
 import yaml
+import json
+import os
 import re
-from time import sleep, time
-from systemd.journal import JournaldLogHandler
+import signal
+import fcntl
+import shutil
+import sys
+import gzip
+import hmac
+import atexit
+from time import sleep, time, monotonic
 from enum import IntEnum
 from subprocess import run, PIPE
 from datetime import datetime
-
-
-# load the configuration from a file
-with open('/etc/cardano/jorm_master.yaml', 'r') as f:
+from collections import namedtuple, deque
+from itertools import count
+from heapq import heappush, heappop
+from bisect import bisect_left, bisect_right
+from threading import Lock, Condition, Event, Thread, local
+from queue import Queue, Full
+from logging.handlers import QueueHandler, QueueListener
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+try:
+    from jeepney import DBusAddress, HeaderFields, MessageType, new_method_call
+    from jeepney.io.blocking import open_dbus_connection
+except ImportError:  # D-Bus support is optional, systemctl is used instead
+    open_dbus_connection = None
+
+try:
+    from systemd.journal import JournaldLogHandler
+except ImportError:  # e.g. simulations on a development machine, log to stderr
+    JournaldLogHandler = logging.StreamHandler
+
+
+# load the configuration from a file, the path can be overridden for simulations
+with open(os.environ.get('JORM_MASTER_CONFIG', '/etc/cardano/jorm_master.yaml'), 'r') as f:
     config = yaml.safe_load(f)
 
 p = config['pooltool']
 pooltool_endp = f'{p["endp_tip"]}?poolid={p["pool_id"]}&userid={p["user_id"]}&genesispref={p["genesis"][:14]}&mytip='
 del(p)
 
-# Initialize systemd logging
+
+class RepeatFilter(logging.Filter):
+    """Rate limiting of identical log messages
+
+    At most burst identical messages (the same level and text) pass within the window, the rest are dropped.
+    The first message passed after the window reports how many were dropped.
+    """
+    def __init__(self, window, burst):
+        super().__init__()
+        self.__window = window
+        self.__burst = burst
+        self.__seen = {}  # (level, message) -> [monotonic time of the first passed in the window, passed, dropped]
+        self.__lock = Lock()
+
+    def filter(self, record):
+        key = (record.levelno, record.getMessage())
+        now = monotonic()
+        with self.__lock:
+            seen = self.__seen.get(key)
+            if seen is not None and now - seen[0] < self.__window:
+                if seen[1] >= self.__burst:
+                    seen[2] += 1
+                    metrics.inc('jorm_log_suppressed_total')
+                    return False
+                seen[1] += 1
+                return True
+            if len(self.__seen) > 1000:  # forget messages which aren't repeated any more
+                self.__seen = {k: v for k, v in self.__seen.items() if now - v[0] < self.__window}
+            self.__seen[key] = [now, 1, 0]
+        if seen is not None and seen[2]:
+            record.msg, record.args = f'{key[1]} (repeated {seen[2]} times more)', None
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler which drops records when the queue is full, so that logging never blocks
+    """
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            metrics.inc('jorm_log_dropped_total')
+
+
+# Initialize systemd logging, the journal is written by a background thread
 logger = logging.getLogger('jorm_master')
 journald_handler = JournaldLogHandler()
 journald_handler.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
-logger.addHandler(journald_handler)
+log_listener = QueueListener(Queue(config.get('log_queue', 10000)), journald_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+log_handler = DroppingQueueHandler(log_listener.queue)
+logger.addHandler(log_handler)
+logger.addFilter(RepeatFilter(config.get('log_repeat_window', 60), config.get('log_repeat_burst', 3)))
 logger.setLevel(logging.INFO)
 
-# Prepare RegExp for choosing between different time formats
-#  - Jormungandr format, e.g. '2019-12-13T19:13:37+00:00'
+# Prepare RegExp for the Jormungandr time format, e.g. '2019-12-13T19:13:37+00:00'
 time_jormungandr = re.compile(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}\+[0-9]{2}:[0-9]{2}$')
-#  - Systemctl format, e.g. 'Fri 2020-01-24 05:52:48 CET'
-time_systemctl = re.compile(r'[A-Z][a-z]{2} [0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2} [A-Z]{3}')
 
 
 def unix_time(time_str):
@@ -43,8 +120,6 @@ def unix_time(time_str):
     if time_jormungandr.match(time_str) is not None:
         t = time_str[:22] + time_str[23:]  # get rid of the ':' in time zone
         return int(datetime.strptime(t, '%Y-%m-%dT%H:%M:%S%z').timestamp())
-    elif time_systemctl.match(time_str) is not None:
-        return int(datetime.strptime(time_str, '%a %Y-%m-%d %H:%M:%S %Z').timestamp())
     else:
         err = f'Cannot convert "{time_str}" to unix time'
         logger.error(err)
@@ -59,162 +134,763 @@ class Status(IntEnum):
     ON = 3    # Running
 
 
+class Metrics:
+    """Counters, gauges and histograms of the master, exported in the Prometheus text format
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__meta = {}    # name -> (type, help), in the order of description
+        self.__values = {}  # name -> {labels: value}, histograms have value [bucket counts..., sum, count]
+
+    def describe(self, name, type, help):
+        self.__meta[name] = (type, help)
+        self.__values[name] = {}
+
+    @staticmethod
+    def __labels(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self.__labels(labels)
+        with self.__lock:
+            self.__values[name][key] = self.__values[name].get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.__lock:
+            self.__values[name][self.__labels(labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self.__labels(labels)
+        with self.__lock:
+            hist = self.__values[name].setdefault(key, [0] * (len(self.BUCKETS) + 2))
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    hist[i] += 1
+                    break
+            hist[-2] += value
+            hist[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe duration of the block in a histogram
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, monotonic() - start, **labels)
+
+    def render(self):
+        """Return all metrics in the Prometheus text format
+        """
+        def fmt(labels, extra=()):
+            pairs = [f'{k}="{v}"' for k, v in labels + tuple(extra)]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        lines = []
+        with self.__lock:
+            for name, (type, help) in self.__meta.items():
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} {type}']
+                for labels, value in sorted(self.__values[name].items()):
+                    if type != 'histogram':
+                        lines.append(f'{name}{fmt(labels)} {value}')
+                        continue
+                    cumulative = 0
+                    for bound, cnt in zip(self.BUCKETS, value):
+                        cumulative += cnt
+                        lines.append(f'{name}_bucket{fmt(labels, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_bucket{fmt(labels, [("le", "+Inf")])} {value[-1]}')
+                    lines.append(f'{name}_sum{fmt(labels)} {value[-2]}')
+                    lines.append(f'{name}_count{fmt(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, host, port):
+        """Serve the metrics on http://host:port/metrics from a background thread
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if urlsplit(self.path).path != '/metrics':
+                    self.send_error(404)
+                    return
+                data = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, name='jorm_metrics', daemon=True).start()
+        return server
+
+
+class TraceRecorder:
+    """Records inputs of the master's decisions (REST responses, unit states, PoolTool values) and its actions
+
+    Records [wall time, kind, key, value] are appended as gzip compressed JSON lines to the file, {date} in its path
+    is replaced by the current date. Traces are replayed offline by jorm_replay.py. Disabled until open() is called.
+    """
+    def __init__(self):
+        self.__lock = Lock()
+        self.__path = None
+        self.__name = None
+        self.__file = None
+
+    def open(self, path):
+        self.__path = path
+
+    def enabled(self):
+        return self.__path is not None
+
+    def record(self, kind, key, value, t=None):
+        """Record a value, t is the wall time the master asked for it (default now)
+        """
+        if self.__path is None:
+            return
+        line = json.dumps([round(time() if t is None else t, 3), kind, key, value], separators=(',', ':'))
+        with self.__lock:
+            try:
+                name = self.__path.format(date=datetime.fromtimestamp(time()).strftime('%Y%m%d'))
+                if name != self.__name:
+                    if self.__file is not None:
+                        self.__file.close()
+                    self.__file, self.__name = gzip.open(name, 'at'), name
+                self.__file.write(line + '\n')
+            except Exception as e:
+                logger.error(f'Cannot write trace to {self.__path} ({e}), tracing disabled')
+                self.__path = None
+
+    def flush(self):
+        """Finish the gzip member written so far, so the trace stays readable if the master is killed
+
+        The next record starts a new member of the same file.
+        """
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file, self.__name = None, None
+
+
+tracer = TraceRecorder()
+
+# Recent actions of the master, (unix time, action, runner id), served by the status API
+decisions = deque(maxlen=100)
+
+metrics = Metrics()
+metrics.describe('jorm_http_request_seconds', 'histogram', 'Duration of HTTP requests by target and endpoint')
+metrics.describe('jorm_http_errors_total', 'counter', 'Failed HTTP requests by target and endpoint')
+metrics.describe('jorm_systemd_call_seconds', 'histogram', 'Duration of calls to systemd')
+metrics.describe('jorm_phase_seconds', 'histogram', 'Duration of the phases of the control loop')
+metrics.describe('jorm_probes_total', 'counter', 'Probes of the runners by tier (tip or full stats)')
+metrics.describe('jorm_cache_requests_total', 'counter', 'Lookups of cached values, by result (hit or miss)')
+metrics.describe('jorm_runner_restarts_total', 'counter', '(Re)starts of the runners')
+metrics.describe('jorm_leader_handoff_seconds', 'histogram', 'Time without a leader during leadership handoffs')
+metrics.describe('jorm_runner_height', 'gauge', 'Block height of the runners')
+metrics.describe('jorm_runner_status', 'gauge', 'Status of the runners (1 off, 2 bootstrapping, 3 running)')
+metrics.describe('jorm_runner_leader', 'gauge', 'Is the runner a leader')
+metrics.describe('jorm_runner_last_block_time', 'gauge', 'Unix time, when the tip of the runner last changed')
+metrics.describe('jorm_runner_blocks_per_second', 'gauge', 'Block rate of the runners over the stall window')
+metrics.describe('jorm_reference_height', 'gauge', 'Reference height of the chain for detecting stuck runners')
+metrics.describe('jorm_standby_ready', 'gauge', 'Runners ready to be promoted (running and synced)')
+metrics.describe('jorm_log_suppressed_total', 'counter', 'Log messages dropped as identical repeated ones')
+metrics.describe('jorm_log_dropped_total', 'counter', 'Log messages dropped on a full logging queue')
+
+
+# Factory of HTTP sessions of the Transport, replaced by a replay of a trace
+session_factory = requests.Session
+
+
+def use_clock(wall, mono):
+    """Replace the wall and the monotonic clock of the master, e.g. by a simulated clock for a replay
+    """
+    global time, monotonic
+    time, monotonic = wall, mono
+
+
+# Deadline of HTTP requests made by the current thread, see budget()
+http_deadline = local()
+
+
+class BudgetExceeded(Exception):
+    """HTTP request skipped, because the time budget of the current cycle was exhausted
+
+    A request that was sent and timed out, even on a timeout shortened by the budget, raises the timeout instead,
+    as the other side didn't answer in the time it was given.
+    """
+
+
+@contextmanager
+def budget_until(deadline):
+    """Limit HTTP requests made by the current thread within the block to the monotonic deadline (None = no limit)
+    """
+    prev = getattr(http_deadline, 'value', None)
+    if deadline is not None and prev is not None:
+        deadline = min(deadline, prev)
+    http_deadline.value = deadline if deadline is not None else prev
+    try:
+        yield
+    finally:
+        http_deadline.value = prev
+
+
+def budget(seconds):
+    """Limit total time of HTTP requests made by the current thread within the block
+    """
+    return budget_until(monotonic() + seconds)
+
+
+class Transport:
+    """HTTP session with a keep-alive connection pool and timeouts, requests are limited by the current budget
+
+    Durations of the requests are recorded in metrics, labeled by the target, and responses in the trace if traced.
+    """
+    def __init__(self, connect_timeout, read_timeout, pool_size=2, target='', traced=True):
+        self.__timeout = (connect_timeout, read_timeout)
+        self.__target = target
+        self.__traced = traced
+        self.__session = session_factory()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+
+    def request(self, method, url, read_timeout=None, **kwargs):
+        """Make a request, raises BudgetExceeded if there isn't enough time left in the budget
+
+        read_timeout overrides the read timeout of the session, e.g. for long running actions
+        """
+        connect, read = self.__timeout[0], read_timeout or self.__timeout[1]
+        deadline = getattr(http_deadline, 'value', None)
+        if deadline is not None:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise BudgetExceeded(f'No time left for {method} {url}')
+            connect, read = min(connect, remaining), min(read, remaining)
+
+        endpoint = re.sub(r'/[0-9]+$', '/{id}', urlsplit(url).path)
+        start = monotonic()
+        traced = self.__traced and tracer.enabled()
+        asked = time()
+        try:
+            resp = self.__session.request(method, url, timeout=(connect, read), **kwargs)
+            if traced:
+                tracer.record('http', f'{method} {url}', [resp.status_code, resp.text], asked)
+            return resp
+        except Exception as e:
+            metrics.inc('jorm_http_errors_total', target=self.__target, endpoint=endpoint)
+            if traced:
+                tracer.record('http', f'{method} {url}', ['error', type(e).__name__], asked)
+            raise
+        finally:
+            metrics.observe('jorm_http_request_seconds', monotonic() - start, target=self.__target, method=method,
+                            endpoint=endpoint)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+
+def http_config(key, default):
+    return config.get('http', {}).get(key, default)
+
+
+def reference_config(key, default):
+    return config.get('height_reference', {}).get(key, default)
+
+
+# State of a runner's systemd unit, 'since' is ActiveEnterTimestampMonotonic in seconds (0 if never active)
+Unit = namedtuple('Unit', ['state', 'since'])
+UNKNOWN_UNIT = Unit('unknown', 0)
+# unit of a runner, whose agent doesn't answer for a while, the node itself may still be running
+UNREACHABLE_UNIT = Unit('unreachable', 0)
+
+
+def unit_name(id):
+    """Return name of the systemd unit of a runner
+    """
+    return f'jorm_runner@{id}.service'
+
+
+class SystemdDBus:
+    """Control runners' units through a persistent D-Bus connection to the systemd manager
+    """
+    def __init__(self):
+        self.__lock = Lock()
+        self.__conn = None
+        self.__manager = DBusAddress('/org/freedesktop/systemd1', bus_name='org.freedesktop.systemd1',
+                                     interface='org.freedesktop.systemd1.Manager')
+        self.__connect()
+
+    def __connect(self):
+        if self.__conn is None:
+            self.__conn = open_dbus_connection(bus='SYSTEM')
+        return self.__conn
+
+    @staticmethod
+    def __unit_path(id):
+        """Return D-Bus object path of the unit, non-alphanumeric characters are escaped as by systemd
+        """
+        label = ''.join(c if c.isascii() and c.isalnum() else f'_{ord(c):02x}' for c in unit_name(id))
+        return f'/org/freedesktop/systemd1/unit/{label}'
+
+    def __call(self, messages, timeout=2):
+        """Send all messages at once and wait for all replies, return list of reply bodies (None on error)
+        """
+        with self.__lock:
+            try:
+                conn = self.__connect()
+                pending = {}
+                for i, msg in enumerate(messages):
+                    serial = next(conn.outgoing_serial)
+                    conn.send(msg, serial=serial)
+                    pending[serial] = i
+
+                replies = [None] * len(messages)
+                deadline = monotonic() + timeout
+                while pending:
+                    reply = conn.receive(timeout=max(deadline - monotonic(), 0))
+                    i = pending.pop(reply.header.fields.get(HeaderFields.reply_serial, -1), None)
+                    if i is not None and reply.header.message_type == MessageType.method_return:
+                        replies[i] = reply.body
+                return replies
+            except Exception:
+                # reconnect on the next call
+                if self.__conn is not None:
+                    self.__conn.close()
+                self.__conn = None
+                raise
+
+    def units(self, ids):
+        """Return dict of unit states for given runner ids, queried in a single round trip
+        """
+        messages = []
+        for id in ids:
+            props = DBusAddress(self.__unit_path(id), bus_name='org.freedesktop.systemd1',
+                                interface='org.freedesktop.DBus.Properties')
+            for prop in ['ActiveState', 'ActiveEnterTimestampMonotonic']:
+                messages.append(new_method_call(props, 'Get', 'ss', ('org.freedesktop.systemd1.Unit', prop)))
+
+        replies = self.__call(messages)
+        res = {}
+        for i, id in enumerate(ids):
+            state, since = replies[2 * i], replies[2 * i + 1]
+            # properties are wrapped in variants, e.g. (('s', 'active'),)
+            res[id] = Unit(state[0][1], since[0][1] / 1e6) if state and since else UNKNOWN_UNIT
+        return res
+
+    def __manager_call(self, method, signature, body):
+        if self.__call([new_method_call(self.__manager, method, signature, body)])[0] is None:
+            raise RuntimeError(f'systemd {method} failed')
+
+    def restart(self, id):
+        """(Re)start the unit of a runner
+        """
+        self.__manager_call('RestartUnit', 'ss', (unit_name(id), 'replace'))
+
+    def stop(self, id):
+        """Stop the unit of a runner
+        """
+        self.__manager_call('StopUnit', 'ss', (unit_name(id), 'replace'))
+
+    def kill(self, id, sig):
+        """Send a signal to all processes of the unit of a runner
+        """
+        self.__manager_call('KillUnit', 'ssi', (unit_name(id), 'all', int(sig)))
+
+
+class Systemctl:
+    """Control runners' units by forking systemctl, used when D-Bus isn't available
+    """
+    def units(self, ids):
+        """Return dict of unit states for given runner ids, queried by a single systemctl call
+        """
+        names = {unit_name(id): id for id in ids}
+        out = run(['systemctl', 'show', '--property=Id,ActiveState,ActiveEnterTimestampMonotonic', *names],
+                  stdout=PIPE, check=True).stdout.decode('utf-8')
+
+        res = {id: UNKNOWN_UNIT for id in ids}
+        # properties of each unit are separated by an empty line
+        for block in out.strip().split('\n\n'):
+            props = dict(line.split('=', 1) for line in block.splitlines() if '=' in line)
+            if props.get('Id') in names:
+                since = int(props.get('ActiveEnterTimestampMonotonic') or 0) / 1e6
+                res[names[props['Id']]] = Unit(props.get('ActiveState', 'unknown'), since)
+        return res
+
+    def restart(self, id):
+        run(['systemctl', 'restart', unit_name(id)], check=True)
+
+    def stop(self, id):
+        run(['systemctl', 'stop', unit_name(id)], check=True)
+
+    def kill(self, id, sig):
+        run(['systemctl', 'kill', f'--signal={signal.Signals(sig).name}', unit_name(id)], check=True)
+
+
+def systemd_backend():
+    """Return systemd backend selected in the configuration, falls back to systemctl if D-Bus is unavailable
+    """
+    if config.get('systemd', 'dbus') == 'dbus':
+        if open_dbus_connection is None:
+            logger.warning('Python module jeepney is not installed, falling back to systemctl')
+        else:
+            try:
+                return SystemdDBus()
+            except Exception:
+                logger.warning('Cannot connect to systemd over D-Bus, falling back to systemctl')
+    return Systemctl()
+
+
+class RunnerSnapshot:
+    """Immutable view of a runner, taken once per cycle
+    """
+    __slots__ = ('id', 'status', 'height', 'uptime', 'leader', 'unit', 'service_uptime', 'tip', 'taken')
+
+    def __init__(self, id, status, height=0, uptime=0, leader=False, unit='inactive', service_uptime=0, tip=None,
+                 taken=None):
+        values = (id, status, height, uptime, leader, unit, service_uptime, tip, time() if taken is None else taken)
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('RunnerSnapshot is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('RunnerSnapshot is immutable')
+
+    def __repr__(self):
+        return (f'RunnerSnapshot(id={self.id}, status={self.status.name}, height={self.height}, '
+                f'uptime={self.uptime}, leader={self.leader}, unit={self.unit}, '
+                f'service_uptime={self.service_uptime:.0f})')
+
+    def replace(self, **changes):
+        """Return a new snapshot with the given fields changed
+        """
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return RunnerSnapshot(**values)
+
+
+class HeightHistory:
+    """Fixed-size ring buffer of (monotonic time, height, tip changed) samples of a runner
+    """
+    __slots__ = ('__times', '__heights', '__changes', '__next', '__size', '__tip', '__last_change')
+
+    def __init__(self, size=512):
+        self.__times = [0.0] * size
+        self.__heights = [0] * size
+        self.__changes = [False] * size
+        self.__next = 0   # index for the next sample
+        self.__size = 0   # number of valid samples
+        self.__tip = None
+        self.__last_change = None
+
+    def add(self, t, height, tip):
+        """Record a sample, the tip changed if the last block (hash or height) differs from the previous sample
+        """
+        prev = (self.__next - 1) % len(self.__times)
+        changed = self.__size == 0 or tip != self.__tip or height != self.__heights[prev]
+        self.__tip = tip
+        if changed:
+            self.__last_change = t
+        i = self.__next
+        self.__times[i], self.__heights[i], self.__changes[i] = t, height, changed
+        self.__next = (i + 1) % len(self.__times)
+        self.__size = min(self.__size + 1, len(self.__times))
+
+    def clear(self):
+        self.__next = self.__size = 0
+        self.__tip = self.__last_change = None
+
+    def samples(self):
+        """Return list of (time, height, tip changed) samples, oldest first
+        """
+        start = (self.__next - self.__size) % len(self.__times)
+        idx = [(start + i) % len(self.__times) for i in range(self.__size)]
+        return [(self.__times[i], self.__heights[i], self.__changes[i]) for i in idx]
+
+    def last_change(self):
+        """Return monotonic time of the last tip change, or None if no sample was recorded
+        """
+        return self.__last_change
+
+    def rate(self, window, now):
+        """Return block rate (blocks per second) over the window, or None if the history doesn't cover half of it
+        """
+        samples = [(t, h) for t, h, _ in self.samples() if t >= now - window]
+        if len(samples) < 2 or samples[-1][0] - samples[0][0] < window / 2:
+            return None
+        return (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0])
+
+
 class Runner:
-    def __init__(self, id):
+    def __init__(self, id, hosts, rest=None):
         self.id = id
-        self.__session = requests.Session()
-        self.__rest = f'http://127.0.0.1:{config["rest_prefix"]}{id}'
-        # caching of status and height results
-        self.__status = None
-        self.__height = None
-        self.__uptime = None
-        self.__status_updated_time = 0
-        self.__height_updated_time = 0
-        self.__uptime_updated_time = 0
+        self.__logger = logging.LoggerAdapter(logger, {'RUNNER_ID': id})  # journal field of the runner's messages
+        self.__hosts = hosts  # systemd units of the runners, on whichever host they are
+        self.__session = Transport(http_config('connect_timeout', 1), http_config('read_timeout', 3),
+                                   target=f'runner_{id}')
+        self.__rest = rest or f'http://127.0.0.1:{config["rest_prefix"]}{id}'
+        # the last snapshot of the runner, updated by poll()
+        self.__snapshot = RunnerSnapshot(id, Status.OFF, taken=0)
+        self.__failing_since = None  # monotonic time of the first failed REST request in a row
+        self.__stats_taken = None    # monotonic time of the last full stats, None forces full stats on the next poll
+        self.__stats_since = None    # start of the unit the last full stats were taken from
+        self.__unit_since = None     # start of the unit seen by the last poll
+        self.__node_started = None   # unix time of the node's start, from the uptime of the last full stats
+        self.__suspended = False     # stopped by SIGSTOP from the master, it cannot answer until resumed
+        self.history = HeightHistory()
+        # leader ids tracked locally from promote/demote, verified against the node only now and then
+        self.__leader_ids_known = []
+        self.__leaders_checked = None  # monotonic time of the last verification, None forces verification
 
     def __node_stats(self):
         """Return node stats in JSON format for a specific instance. Passes exceptions
         """
         return self.__session.get(f'{self.__rest}/api/v0/node/stats').json()
 
-    def __settings(self, key):
-        """Return settings value for specified key, or None if unavailable
+    def __node_tip(self):
+        """Return hash of the node's tip as a string, a much cheaper request than node stats. Passes exceptions
         """
-        try:
-            logger.info(f'Reading property {key} from settings')
-            res = self.__session.get(f'{self.__rest}/api/v0/settings').json()[key]
-            logger.info(f'Obtained {key}: {res}')
-            return res
-        except Exception:
-            return None
+        resp = self.__session.get(f'{self.__rest}/api/v0/tip')
+        resp.raise_for_status()
+        return resp.content.decode('utf-8').strip()  # without guessing the encoding of a plain text
 
-    def status(self):
-        """Return runner's status - ON/BOOT/OFF
-        """
-        if self.__status is None or time() - self.__status_updated_time > 2:
-            # Update cached value
-            if run(['systemctl', 'is-active', '--quiet', f'jorm_runner@{self.id}']).returncode == 0:
-                failures = 0
-                while True:
-                    try:
-                        status = self.__node_stats()['state']
-                        if status == 'Running':
-                            self.__status = Status.ON
-                        elif status in ['Bootstrapping', 'PreparingBlock0']:
-                            self.__status = Status.BOOT
-                        else:
-                            raise ValueError("Cannot decide runner's status")
-                        break
-                    except Exception:
-                        failures += 1
-                        if failures >= 2:
-                            logger.error(f'Jormungandr runner {self.id} is not responding to REST api requests, stopping')
-                            self.stop()
-                            self.__status = Status.OFF
-                            break
-                        sleep(5)
-            else:
-                self.__status = Status.OFF
+    def __stats_due(self, unit):
+        """Decide if full node stats are needed, or the tip is enough to tell the runner didn't change
 
-            self.__status_updated_time = time()
+        Full stats are needed unless the runner is running, on the same unit start as the last full stats,
+        and these are not older than probe_stats seconds.
+        """
+        s = self.__snapshot
+        return (s.status != Status.ON or s.unit != unit.state or self.__stats_taken is None or
+                monotonic() - self.__stats_taken >= config.get('probe_stats', 30) or
+                abs((unit.since or 0) - (self.__stats_since or 0)) > 1)  # start times of remote units are approximate
 
-        return self.__status
+    def poll(self, unit=None):
+        """Query the runner once and return a new snapshot of its state
 
-    def height(self):
-        """Return current block height, or 0 if unavailable
+        The unit state is queried from systemd, unless provided by a batched query
         """
+        if unit is None:
+            with metrics.timer('jorm_systemd_call_seconds', call='units'):
+                unit = self.__hosts.units([self.id])[self.id]
+        unreachable = unit.state == UNREACHABLE_UNIT.state and self.__snapshot.status != Status.OFF
+        if unit.state in [UNKNOWN_UNIT.state, UNREACHABLE_UNIT.state] and self.__snapshot.status != Status.OFF:
+            # systemd or the agent doesn't answer, but the node may still be running and leading, ask the node itself
+            unit = Unit(self.__snapshot.unit, self.__unit_since or 0)
+        elif unit.state == UNKNOWN_UNIT.state:
+            self.__logger.warning(f'Unknown state of Jormungandr runner {self.id} unit, keeping the last snapshot')
+            return self.__snapshot
+        if unit.state not in ['active', 'reloading']:
+            self.__snapshot = RunnerSnapshot(self.id, Status.OFF, unit=unit.state)
+            self.__suspended = False
+            self.__leader_ids_known = []
+            self.__leaders_checked = None
+            return self.__snapshot
+        # (re)started, possibly behind our back, with the node secret on its command line and a new leader id,
+        # start times of remote units are approximate
+        if self.__unit_since is None or abs(unit.since - self.__unit_since) > 1:
+            self.__leaders_checked = None
+        self.__unit_since = unit.since
+        if self.__suspended:
+            return self.__snapshot  # doesn't answer, but isn't failing either
+
         try:
-            # Update cache if necessary
-            if self.__height is None or time() - self.__height_updated_time > 2:
-                self.__height = int(self.__node_stats()['lastBlockHeight'])
-                self.__height_updated_time = time()
+            if not self.__stats_due(unit) and self.__node_tip() == self.__snapshot.tip:
+                metrics.inc('jorm_probes_total', tier='tip')
+                self.__failing_since = None
+                return self.__tip_unchanged(unit)
+            stats = self.__node_stats()
+            metrics.inc('jorm_probes_total', tier='stats')
+            if stats['state'] == 'Running':
+                status = Status.ON
+            elif stats['state'] in ['Bootstrapping', 'PreparingBlock0']:
+                status = Status.BOOT
+            else:
+                raise ValueError("Cannot decide runner's status")
+            self.__failing_since = None
+            self.__stats_taken = monotonic() if status == Status.ON else None
+            self.__stats_since = unit.since
+        except BudgetExceeded:
+            return self.__snapshot  # not sent, the runner wasn't asked
         except Exception:
-            self.__height = 0
-            self.__height_updated_time = time()
+            # Keep the last snapshot and retry on the next poll, stop the runner if it doesn't respond for too long
+            if self.__failing_since is None:
+                self.__failing_since = monotonic()
+            elif monotonic() - self.__failing_since >= 5 and unreachable:
+                # neither the agent nor the node answers, the node cannot be stopped, it is most likely down
+                self.__logger.error(f'Jormungandr runner {self.id} and its agent are not responding, '
+                                    f'considering it stopped')
+                self.__snapshot = RunnerSnapshot(self.id, Status.OFF, unit=UNREACHABLE_UNIT.state)
+                self.__failing_since = None
+                self.__leader_ids_known = []
+                self.__leaders_checked = None
+            elif monotonic() - self.__failing_since >= 5:
+                self.__logger.error(f'Jormungandr runner {self.id} is not responding to REST api requests, stopping')
+                self.stop()
+            return self.__snapshot
 
-        return self.__height
-
-    def uptime(self):
-        """Return current node uptime, or 0 if unavailable
-        """
         try:
-            # Update cache if necessary
-            if self.__uptime is None or time() - self.__uptime_updated_time > 2:
-                self.__uptime = int(self.__node_stats()['uptime'])
-                self.__uptime_updated_time = time()
+            height = int(stats['lastBlockHeight'])
+        except Exception:
+            height = 0
+        try:
+            uptime = int(stats['uptime'])
         except Exception:
-            self.__uptime = 0
-            self.__uptime_updated_time = time()
+            uptime = 0
+        self.__node_started = time() - uptime
+
+        if status == Status.ON:
+            self.__check_leader_ids()
+        leader = status == Status.ON and bool(self.__leader_ids_known)
+        service_uptime = monotonic() - unit.since if unit.since else 0
+        tip = stats.get('lastBlockHash')
+        # a bootstrapping node has no height, the rate from its start would be far above the real one
+        if status == Status.ON:
+            self.history.add(monotonic(), height, tip)
+        else:
+            self.history.clear()
+        self.__snapshot = RunnerSnapshot(self.id, status, height, uptime, leader, unit.state, service_uptime, tip)
+        metrics.set('jorm_runner_height', height, runner=self.id)
+        return self.__snapshot
 
-        return self.__uptime
+    def __tip_unchanged(self, unit):
+        """Return the last snapshot brought up to date, the tip of the running node is the same
+        """
+        s = self.__snapshot
+        self.__check_leader_ids()
+        self.history.add(monotonic(), s.height, s.tip)
+        self.__snapshot = s.replace(uptime=int(time() - self.__node_started), leader=bool(self.__leader_ids_known),
+                                    service_uptime=monotonic() - unit.since if unit.since else 0, taken=time())
+        return self.__snapshot
+
+    def __check_leader_ids(self):
+        """Verify the locally tracked leader ids, if the last verification is older than leader_check seconds
+        """
+        if self.__leaders_checked is None or monotonic() - self.__leaders_checked > config.get('leader_check', 30):
+            metrics.inc('jorm_cache_requests_total', cache='leaders', result='miss')
+            self.__verify_leader_ids()
+        else:
+            metrics.inc('jorm_cache_requests_total', cache='leaders', result='hit')
 
-    def service_uptime(self):
-        """Return current uptime of the runner service (from systemctl)
+    def snapshot(self):
+        """Return the last snapshot of the runner
         """
-        try:
-            time_str = run(['systemctl', 'show', f'jorm_runner@{self.id}.service', '--property=ActiveEnterTimestamp'],
-                           stdout=PIPE).stdout.decode('utf-8').split('=')[1].strip()
-            return time() - unix_time(time_str)
-        except Exception:
-            logger.warning(f'Cannot read uptime (systemctl) of a runner {self.id}')
-            return 0
+        return self.__snapshot
 
     def restart(self):
         """(Re)start Jormungandr runner
         """
-        logger.warning(f'(Re)starting Jormungandr runner {self.id}')
-        run(['systemctl', 'restart', f'jorm_runner@{self.id}.service'])
-        self.__status_updated_time = 0  # expire cache
+        self.__logger.warning(f'(Re)starting Jormungandr runner {self.id}')
+        try:
+            with metrics.timer('jorm_systemd_call_seconds', call='restart'):
+                self.__hosts.restart(self.id)
+        except Exception:
+            self.__logger.error(f'Cannot (re)start Jormungandr runner {self.id}')
+            return
+        decisions.append((time(), 'restart', self.id))
+        metrics.inc('jorm_runner_restarts_total', runner=self.id)
+        # the runner is bootstrapping from now on, until the next poll tells otherwise
+        self.__snapshot = RunnerSnapshot(self.id, Status.BOOT, unit='active')
+        self.__failing_since = None
+        self.__suspended = False
+        self.history.clear()
+        # the runner may start as a leader (node secret in its command line)
+        self.__leader_ids_known = []
+        self.__leaders_checked = None
 
     def stop(self):
-        """Stop Jormungandr runner
+        """Stop Jormungandr runner. Return True on success
         """
-        logger.info(f'Stopping Jormungandr runner {self.id}')
-        run(['systemctl', 'stop', f'jorm_runner@{self.id}.service'])
-        self.__status_updated_time = 0  # expire cache
+        self.__logger.info(f'Stopping Jormungandr runner {self.id}')
+        try:
+            with metrics.timer('jorm_systemd_call_seconds', call='stop'):
+                self.__hosts.stop(self.id)
+        except Exception:
+            self.__logger.error(f'Cannot stop Jormungandr runner {self.id}')
+            return False
+        decisions.append((time(), 'stop', self.id))
+        self.__snapshot = RunnerSnapshot(self.id, Status.OFF)
+        self.__failing_since = None
+        self.__suspended = False
+        self.__leader_ids_known = []
+        self.__leaders_checked = None
+        return True
 
     def suspend(self):
         """Suspend Jormungandr runner
         """
-        logger.info(f'Suspending Jormungandr runner {self.id}')
-        run(['systemctl', 'kill', '--signal=SIGSTOP', f'jorm_runner@{self.id}.service'])
+        self.__logger.info(f'Suspending Jormungandr runner {self.id}')
+        try:
+            with metrics.timer('jorm_systemd_call_seconds', call='kill'):
+                self.__hosts.kill(self.id, signal.SIGSTOP)
+            self.__suspended = True
+            decisions.append((time(), 'suspend', self.id))
+        except Exception:
+            self.__logger.error(f'Cannot suspend Jormungandr runner {self.id}')
 
     def resume(self):
         """Resume suspended Jormungandr runner
         """
-        logger.info(f'Resuming Jormungandr runner {self.id}')
-        run(['systemctl', 'kill', '--signal=SIGCONT', f'jorm_runner@{self.id}.service'])
-
-    def block_0_time(self):
-        """Return block 0 time from settings, or None if unavailable
-        """
-        time_text = self.__settings('block0Time')  # e.g. '2019-12-13T19:13:37+00:00'
-        return unix_time(time_text) if time_text else None
+        self.__logger.info(f'Resuming Jormungandr runner {self.id}')
+        try:
+            with metrics.timer('jorm_systemd_call_seconds', call='kill'):
+                self.__hosts.kill(self.id, signal.SIGCONT)
+            self.__suspended = False
+            self.__failing_since = None
+            decisions.append((time(), 'resume', self.id))
+        except Exception:
+            self.__logger.error(f'Cannot resume Jormungandr runner {self.id}')
 
-    def slot_duration(self):
-        """Return slot duration from settings, or None if unavailable
+    def settings(self):
+        """Return tuple (block 0 time, slot duration, slots per epoch) from settings, or None if unavailable
         """
-        slot_duration = self.__settings('slotDuration')
-        return int(slot_duration) if slot_duration else None
+        try:
+            res = self.__session.get(f'{self.__rest}/api/v0/settings').json()
+            settings = (unix_time(res['block0Time']),  # e.g. '2019-12-13T19:13:37+00:00'
+                        int(res['slotDuration']),
+                        int(res['slotsPerEpoch']))
+            self.__logger.info(f'Jormungandr runner {self.id} settings: block0Time {res["block0Time"]}, '
+                               f'slotDuration {settings[1]}, slotsPerEpoch {settings[2]}')
+            return settings
+        except Exception:
+            return None
 
-    def slots_per_epoch(self):
-        """Return number of slots per epoch, or None if unavailable
+    def __verify_leader_ids(self):
+        """Compare the locally tracked leader ids with the node, the node is right. Return True on success
         """
-        slots_per_epoch = self.__settings('slotsPerEpoch')
-        return int(slots_per_epoch) if slots_per_epoch else None
+        try:
+            ids = self.__session.get(f'{self.__rest}/api/v0/leaders').json()
+        except Exception:
+            return False  # unknown, keep the local state
+        if self.__leaders_checked is not None and sorted(ids) != sorted(self.__leader_ids_known):
+            self.__logger.warning(f'Jormungandr runner {self.id} has leader ids {ids}, expected {self.__leader_ids_known}')
+        self.__leader_ids_known = ids
+        self.__leaders_checked = monotonic()
+        return True
 
     def leader_ids(self):
-        """Return list of all leader IDs
+        """Return list of all leader IDs (tracked locally)
         """
-        try:
-            return self.__session.get(f'{self.__rest}/api/v0/leaders').json()
-        except Exception:
-            return []
+        return list(self.__leader_ids_known)
 
     def is_leader(self):
-        """Check if runner is in leader mode
+        """Check if runner is in leader mode (tracked locally)
         """
-        return bool(self.leader_ids())  # False on empty list, otherwise True
+        return bool(self.__leader_ids_known)  # False on empty list, otherwise True
 
     def leader_events(self):
         """Return list of all leader event times for the current epoch
@@ -225,75 +901,1088 @@ class Runner:
         except Exception:
             return []
 
-    def promote(self):
-        """Make passive node a leader
+    def promote(self, secret):
+        """Make passive node a leader, secret is the node secret serialized to JSON. Return True on success
         """
         try:
-            logger.info(f'Promoting Jormungandr runner {self.id} to leader')
-            with open(config['node_secret'], 'r') as f:
-                secret = yaml.safe_load(f)
-                self.__session.post(f'{self.__rest}/api/v0/leaders', json=secret).raise_for_status()
+            self.__logger.info(f'Promoting Jormungandr runner {self.id} to leader')
+            resp = self.__session.post(f'{self.__rest}/api/v0/leaders', data=secret,
+                                       headers={'Content-Type': 'application/json'})
+            resp.raise_for_status()
+            try:
+                self.__leader_ids_known = self.__leader_ids_known + [int(resp.json())]
+            except Exception:
+                # the new leader id is unknown, get it on the next poll
+                self.__leader_ids_known = self.__leader_ids_known + [None]
+                self.__leaders_checked = None
+            self.__snapshot = self.__snapshot.replace(leader=True)
+            decisions.append((time(), 'promote', self.id))
+            return True
         except Exception:
-            logger.error(f'Cannot promote Jormungandr runner {self.id} to leader')
+            self.__logger.error(f'Cannot promote Jormungandr runner {self.id} to leader')
+            return False
 
     def demote(self):
-        """Make the runner a passive node without the possibility to create blocks
+        """Make the runner a passive node without the possibility to create blocks. Return True on success
         """
         try:
-            for leader_id in self.leader_ids():
-                logger.info(f'Removing leader id {leader_id} from Jormungandr runner {self.id}')
-                self.__session.delete(f'{self.__rest}/api/v0/leaders/{leader_id}').raise_for_status()
+            if None in self.__leader_ids_known:
+                self.__verify_leader_ids()
+            for attempt in range(3):
+                missing = False
+                for leader_id in self.__leader_ids_known:
+                    self.__logger.info(f'Removing leader id {leader_id} from Jormungandr runner {self.id}')
+                    resp = self.__session.delete(f'{self.__rest}/api/v0/leaders/{leader_id}')
+                    if resp.status_code == 404:
+                        missing = True
+                    else:
+                        resp.raise_for_status()
+                if not missing:
+                    break
+                # the runner may have been restarted behind our back with a new leader id, ask the node
+                if not self.__verify_leader_ids():
+                    raise ValueError('Cannot verify leader ids')
+                if not self.__leader_ids_known:
+                    break
+            else:
+                raise ValueError('Leader ids keep changing')
+            self.__leader_ids_known = []
+            self.__snapshot = self.__snapshot.replace(leader=False)
+            decisions.append((time(), 'demote', self.id))
+            return True
         except Exception:
-            logger.error(f'Cannot demote Jormungandr runner {self.id}')
+            self.__logger.error(f'Cannot demote Jormungandr runner {self.id}')
+            return False
 
 
 class PoolTool:
+    """Non-blocking PoolTool client, requests are made by a background thread
+
+    Majority max is refreshed periodically and read from a cache, reported heights are coalesced to the latest one.
+    An endpoint failing repeatedly is retried with an exponential backoff.
+    """
     def __init__(self):
-        self.__session = requests.Session()
-        self.__majority_max = 0
-        self.__last_sent = 0
-        self.__last_recv = 0
+        self.__session = Transport(http_config('connect_timeout', 1), config['pooltool'].get('timeout', 5),
+                                   target='pooltool', traced=False)
+        self.__majority_max = (0, None)  # (value, monotonic time of update), replaced as a whole
         self.__last_height = 1
+        self.__pending_height = None
+        self.__next = {'recv': 0, 'send': 0}      # monotonic time of the next request to each endpoint
+        self.__failures = {'recv': 0, 'send': 0}  # consecutive failures of each endpoint
+        self.__lock = Lock()
+        self.__wakeup = Event()
+        self.__thread = Thread(target=self.__run, name='jorm_pooltool', daemon=True)
+
+    def start(self):
+        """Start the background thread
+        """
+        self.__thread.start()
 
     def send_height(self, height):
-        """Send the current height tip to the PoolTool website
+        """Queue the current height tip to be sent to the PoolTool website
         """
-        if time() - self.__last_sent < config['pooltool']['send_wait'] or height <= self.__last_height:
-            return
+        with self.__lock:
+            if height > max(self.__last_height, self.__pending_height or 0):
+                self.__pending_height = height
+                self.__wakeup.set()
+
+    def majority_max(self, traced=True):
+        """Return tuple (majority max, its age in seconds) from PoolTool, age is None if it was never received
+        """
+        value, updated = self.__majority_max
+        res = value, (monotonic() - updated if updated is not None else None)
+        if traced:
+            tracer.record('pooltool', None, res)
+        return res
 
+    def __done(self, endpoint, ok, wait):
+        """Schedule the next request to the endpoint, with an exponential backoff on repeated failures
+        """
+        if ok:
+            if self.__failures[endpoint] > 0:
+                logger.info(f'PoolTool {endpoint} endpoint is available again')
+            self.__failures[endpoint] = 0
+        else:
+            self.__failures[endpoint] += 1
+            wait = min(wait * 2 ** (self.__failures[endpoint] - 1), config['pooltool'].get('max_backoff', 600))
+            if self.__failures[endpoint] == 1:
+                logger.warning(f'PoolTool {endpoint} endpoint is unavailable, backing off')
+        self.__next[endpoint] = monotonic() + wait
+
+    def __send(self):
+        with self.__lock:
+            height = self.__pending_height
         try:
-            logger.info(f'Sending height {height} to PoolTool')
             self.__session.get(pooltool_endp + str(height)).raise_for_status()
-            self.__last_sent = time()
-            self.__last_height = height
+            logger.debug(f'Sent height {height} to PoolTool')
+            with self.__lock:
+                self.__last_height = height
+                if self.__pending_height == height:
+                    self.__pending_height = None
+            self.__done('send', True, config['pooltool']['send_wait'])
+        except Exception:
+            self.__done('send', False, config['pooltool']['send_wait'])
+
+    def __recv(self):
+        try:
+            resp = self.__session.get(config['pooltool']['endp_stats'])
+            resp.raise_for_status()
+            self.__majority_max = (int(resp.json()['majoritymax']), monotonic())
+            self.__done('recv', True, config['pooltool']['recv_wait'])
         except Exception:
-            logger.error('Cannot connect to PoolTool')
+            self.__done('recv', False, config['pooltool']['recv_wait'])
 
-    def majority_max(self):
-        """Return majority max value from PoolTool, or last known value if unavailable
+    def __run(self):
+        while True:
+            if monotonic() >= self.__next['recv']:
+                self.__recv()
+            if self.__pending_height is not None and monotonic() >= self.__next['send']:
+                self.__send()
+
+            due = [self.__next['recv']] + ([self.__next['send']] if self.__pending_height is not None else [])
+            self.__wakeup.wait(max(min(due) - monotonic(), 0))
+            self.__wakeup.clear()
+
+
+class PeerHeights:
+    """Heights of trusted peer nodes (not managed by the master), polled by a background thread
+    """
+    def __init__(self, urls):
+        self.__urls = list(urls)
+        self.__session = Transport(http_config('connect_timeout', 1), http_config('read_timeout', 3),
+                                   target='peer', traced=False)
+        self.__heights = {}  # url -> (height, monotonic time), replaced as a whole
+        self.__thread = Thread(target=self.__run, name='jorm_peers', daemon=True)
+
+    def start(self):
+        """Start the background thread, if there are any peers
         """
-        if time() - self.__last_recv >= config['pooltool']['recv_wait']:
-            try:
-                resp = self.__session.get(config['pooltool']['endp_stats'])
-                resp.raise_for_status()
-                self.__majority_max = int(resp.json()['majoritymax'])
-                self.__last_recv = time()
-            except Exception:
-                logger.warning(f"Couldn't update majority max from PoolTool, using last known value {self.__majority_max}")
+        if self.__urls:
+            self.__thread.start()
+
+    def samples(self):
+        """Return dict of url -> (height, age in seconds), a source of the height reference
+        """
+        now = monotonic()
+        return {url: (height, now - updated) for url, (height, updated) in self.__heights.items()}
+
+    def __run(self):
+        while True:
+            for url in self.__urls:
+                try:
+                    stats = self.__session.get(f'{url}/api/v0/node/stats').json()
+                    self.__heights = dict(self.__heights, **{url: (int(stats['lastBlockHeight']), monotonic())})
+                except Exception:
+                    pass  # the last height is kept, it loses weight with its age
+            sleep(reference_config('peer_interval', 20))
+
+
+class HeightReference:
+    """Reference height of the chain, combined from several sources weighted by their freshness and trust
+
+    A source is a function returning dict of key -> (height, age in seconds), e.g. heights of the runners.
+    The weight of a sample halves with every half_life seconds of its age. Samples further than outlier blocks
+    from the weighted median are discarded, e.g. a bogus value from PoolTool. Samples of a local source (the
+    runners) together weigh at most its trust, and they are never used to discard samples of independent sources,
+    so a majority of stuck runners cannot outvote PoolTool or the peers.
+    """
+    def __init__(self, half_life, outlier):
+        self.__half_life = half_life
+        self.__outlier = outlier
+        self.__sources = {}  # name -> (function, trust, local)
+        self.__samples = []  # samples of the last update, list of ((source, key), height, weight)
+        self.height = 0      # the highest accepted height
+
+    def add_source(self, name, func, trust=1.0, local=False):
+        """Add a source of heights, trust (0 to 1) scales the weight of its samples
+        """
+        self.__sources[name] = (func, trust, local)
+
+    def update(self):
+        """Collect samples of all sources, discard outliers, return the reference height (0 if unknown)
+        """
+        self.__samples = []
+        for name, (func, trust, _) in self.__sources.items():
+            for key, (height, age) in func().items():
+                if height and age is not None:
+                    self.__samples.append(((name, key), height, trust * 0.5 ** (max(age, 0) / self.__half_life)))
+
+        self.height = max((height for _, height, _ in self.__accepted(self.__samples)), default=0)
+        metrics.set('jorm_reference_height', self.height)
+        return self.height
+
+    def __accepted(self, samples):
+        """Return the samples with capped weights of local sources, without outliers
+        """
+        capped = []
+        for name, (_, trust, own_local) in self.__sources.items():
+            own = [s for s in samples if s[0][0] == name]
+            total = sum(weight for _, _, weight in own)
+            scale = trust / total if own_local and total > trust else 1
+            capped += [(key, height, weight * scale) for key, height, weight in own]
+
+        def is_local(sample):
+            return self.__sources[sample[0][0]][2]
+
+        median = self.__weighted_median(capped)
+        independent = self.__weighted_median([s for s in capped if not is_local(s)])
+        return [s for s in capped if abs(s[1] - (median if is_local(s) else independent)) <= self.__outlier]
+
+    @staticmethod
+    def __weighted_median(samples):
+        total = sum(weight for _, _, weight in samples)
+        acc = 0
+        for _, height, weight in sorted(samples, key=lambda s: s[1]):
+            acc += weight
+            if acc >= total / 2:
+                return height
+        return 0
+
+    def behind(self, height, exclude=None):
+        """Return confidence (0 to 1), that a runner at the height is more than max_offset blocks behind
+
+        Samples ahead are evidence for, samples at about the same height are evidence against, lower samples
+        tell nothing. exclude is the key of the runner's own sample, it is left out before weighing the samples
+        and discarding outliers.
+        """
+        ahead = against = 0
+        doubt = 1  # probability that all the samples ahead are wrong
+        for _, h, weight in self.__accepted([s for s in self.__samples if s[0] != exclude]):
+            if h - height > config['max_offset']:
+                ahead += weight
+                doubt *= 1 - weight
+            elif height - h <= config['max_offset']:
+                against += weight
+        return ahead / (ahead + against) * (1 - doubt) if ahead else 0
+
+
+def cluster_stalled(runners_idle, pooltool_idle, pooltool_lead):
+    """Has the whole cluster stalled, e.g. on a fork, while the chain goes on?
+
+    runners_idle is list of seconds since the tip of each running runner moved, pooltool_idle seconds since
+    the PoolTool majority max changed (None if unknown), and pooltool_lead its blocks ahead of the best runner.
+    The reference cannot tell, as the runners outvote PoolTool, so it is enough that no tip moved for stall_time
+    while PoolTool kept advancing and is more than max_offset blocks ahead.
+    """
+    stall_time = config.get('stall_time', 120)
+    return (bool(runners_idle) and min(runners_idle) > stall_time and pooltool_idle is not None and
+            pooltool_idle < stall_time and pooltool_lead > config['max_offset'])
 
-        return self.__majority_max
+
+class LeaderSchedule:
+    """Leader events of an epoch, sorted once and searched by bisection
+
+    Queries with epoch_roll also take the epoch end into account, as it needs the same protection as a leader event.
+    Time is expected to move forward, so the search continues from a cursor of the previous query.
+    """
+    def __init__(self, events=(), epoch_end=None):
+        self.events = sorted(events)
+        self.epoch_end = epoch_end
+        self.__merged = sorted(self.events + ([epoch_end] if epoch_end is not None else []))
+        self.__cursors = {False: 0, True: 0}
+        self.__gap_max = {False: self.__gap_table(self.events), True: self.__gap_table(self.__merged)}
+
+    @staticmethod
+    def __gap_table(times):
+        """Return sparse table of the gaps between consecutive events, level k holds maxima of 2 ** k gaps in a row
+        """
+        table = [[b - a for a, b in zip(times, times[1:])]]
+        while 2 ** len(table) <= len(table[0]):
+            prev, half = table[-1], 2 ** (len(table) - 1)
+            table.append([max(prev[j], prev[j + half]) for j in range(len(prev) - half)])
+        return table
+
+    def __times(self, epoch_roll):
+        return self.__merged if epoch_roll else self.events
+
+    def __first_after(self, now, epoch_roll):
+        """Return index of the first event after now
+        """
+        times = self.__times(epoch_roll)
+        cursor = self.__cursors[epoch_roll]
+        if cursor > 0 and times[cursor - 1] > now:
+            cursor = 0  # time went backwards, search everything
+        cursor = bisect_right(times, now, cursor)
+        self.__cursors[epoch_roll] = cursor
+        return cursor
+
+    def __len__(self):
+        return len(self.events)
+
+    def next_event(self, now, epoch_roll=False):
+        """Return time of the first event after now, or None if there is none
+        """
+        times = self.__times(epoch_roll)
+        i = self.__first_after(now, epoch_roll)
+        return times[i] if i < len(times) else None
+
+    def upcoming(self, now, epoch_roll=False):
+        """Return list of events after now
+        """
+        return self.__times(epoch_roll)[self.__first_after(now, epoch_roll):]
+
+    def cnt_upcoming(self, now, epoch_roll=False):
+        """Return number of events after now
+        """
+        return len(self.__times(epoch_roll)) - self.__first_after(now, epoch_roll)
+
+    def window(self, start, end, epoch_roll=False):
+        """Return list of events between start and end (inclusive)
+        """
+        times = self.__times(epoch_roll)
+        return times[bisect_left(times, start):bisect_right(times, end)]
+
+    def free_gap(self, start, duration, epoch_roll=True):
+        """Return the earliest time from start, which is followed by at least duration seconds without events
+
+        Returns None if there is no such gap. With epoch_roll, the schedule after the epoch end is unknown,
+        so a gap cannot reach beyond it.
+        """
+        times = self.__times(epoch_roll)
+        i = bisect_right(times, start)
+        if i < len(times) and times[i] - start >= duration:
+            return start
+
+        # the first gap from the event i on, which is long enough, found by skipping runs of shorter gaps
+        table = self.__gap_max[epoch_roll]
+        for k in reversed(range(len(table))):
+            if i + 2 ** k <= len(table[0]) and table[k][i] < duration:
+                i += 2 ** k
+        if i < len(table[0]):
+            return times[i]
+        if epoch_roll and self.epoch_end is not None:
+            return None
+        return max(times[-1], start) if times else start  # after the last event
+
+
+class BootPlanner:
+    """Plan (re)starts of runners into gaps between events, so they finish bootstrapping before the next event
+
+    Bootstrap duration is measured for each runner, simultaneous bootstraps are expected to slow each other down.
+    """
+    def __init__(self, estimate, contention, margin):
+        self.__estimate = estimate      # bootstrap duration of a runner that wasn't measured yet
+        self.__contention = contention  # relative slowdown caused by each other simultaneous bootstrap
+        self.__margin = margin          # bootstrap has to be finished this long before an event
+        self.durations = {}             # runner id -> measured bootstrap duration
+
+    def duration(self, id):
+        """Return expected bootstrap duration of a runner without contention
+        """
+        return self.durations.get(id, self.__estimate)
+
+    def record(self, id, duration):
+        """Record a measured bootstrap duration, averaged with the previous measurements
+        """
+        prev = self.durations.get(id)
+        self.durations[id] = duration if prev is None else (prev + duration) / 2
+
+    def plan(self, schedule, now, candidates, booting):
+        """Return dict of runner id -> planned start time, or None if there is no gap before the epoch end
+
+        candidates are ids of runners to be (re)started, booting is a dict of runner id -> bootstrap time so far
+        """
+        # time intervals of running and planned bootstraps
+        boots = [(now, now + max(self.duration(id) - elapsed, 0)) for id, elapsed in booting.items()]
+        res = {}
+        # runners with the fastest bootstrap first, they are the most likely to fit before an event
+        for id in sorted(candidates, key=self.duration):
+            start = now
+            while True:
+                end = start + self.duration(id)
+                parallel = sum(1 for b_start, b_end in boots if b_start < end and start < b_end)
+                needed = self.duration(id) * (1 + self.__contention * parallel)
+                gap = schedule.free_gap(start, needed + self.__margin, epoch_roll=True)
+                if gap is None or gap <= start:
+                    break
+                start = gap
+
+            res[id] = start if gap is not None else None
+            if gap is not None:
+                boots.append((start, start + needed))
+        return res
+
+
+FICLONE = 0x40049409  # ioctl for copy-on-write clone of a file (reflink)
+
+
+def clone_file(src, dst, deadline):
+    """Copy a file as a copy-on-write reflink if the filesystem supports it, otherwise copy its content
+
+    Raises TimeoutError if the copy isn't finished before the monotonic deadline
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass  # not supported, e.g. across filesystems or on ext4
+
+        while True:
+            chunk = fsrc.read(1 << 20)
+            if not chunk:
+                break
+            fdst.write(chunk)
+            if monotonic() > deadline:
+                raise TimeoutError(f'Copying of {src} is taking too long')
+
+
+def clone_tree(src, dst, deadline):
+    """Copy a directory tree with ownership and permissions, files are cloned by clone_file
+
+    Hard links are never used, as the node's database files are modified in place.
+    """
+    for root, dirs, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            clone_file(os.path.join(root, name), os.path.join(target, name), deadline)
+        for path, target_path in [(root, target)] + [(os.path.join(root, n), os.path.join(target, n)) for n in files]:
+            st = os.stat(path)
+            os.chown(target_path, st.st_uid, st.st_gid)
+            shutil.copystat(path, target_path)
+
+
+def storage_path(id):
+    """Return storage directory of a runner
+    """
+    return config.get('storage', '/home/cardano/storage_jorm_runner_{id}').format(id=id)
+
+
+def copy_storage(src_id, dst_id, deadline):
+    """Copy storage of the src runner next to the storage of the dst runner, it is put in place by swap_storage()
+    """
+    clone_tree(storage_path(src_id), f'{storage_path(dst_id)}.clone', deadline)
+
+
+def swap_storage(dst_id):
+    """Replace storage of the runner by the copy made by copy_storage()
+    """
+    dst_path = storage_path(dst_id)
+    shutil.rmtree(f'{dst_path}.old', ignore_errors=True)
+    if os.path.exists(dst_path):
+        os.rename(dst_path, f'{dst_path}.old')
+    os.rename(f'{dst_path}.clone', dst_path)
+    shutil.rmtree(f'{dst_path}.old', ignore_errors=True)
+
+
+def discard_storage_copy(dst_id):
+    """Remove an unfinished copy made by copy_storage()
+    """
+    shutil.rmtree(f'{storage_path(dst_id)}.clone', ignore_errors=True)
+
+
+# Definition of a runner: id, URL of its REST API and URL of the agent controlling it (None for this host)
+RunnerConfig = namedtuple('RunnerConfig', ['id', 'rest', 'agent'])
+
+
+def runner_configs(cnt_runners):
+    """Return list of runner definitions from the runners section of the config, or cnt_runners local runners
+    """
+    if config.get('runners'):
+        return [RunnerConfig(i, f'http://{r.get("host", "127.0.0.1")}:{r["port"]}', r.get('agent'))
+                for i, r in enumerate(config['runners'])]
+    return [RunnerConfig(i, f'http://127.0.0.1:{config["rest_prefix"]}{i}', None) for i in range(cnt_runners)]
+
+
+class LocalHost:
+    """Runners on this host, controlled by a systemd backend, with direct access to their storage
+    """
+    def __init__(self, systemd):
+        self.systemd = systemd
+
+    def units(self, ids):
+        return self.systemd.units(ids)
+
+    def restart(self, id):
+        self.systemd.restart(id)
+
+    def stop(self, id):
+        self.systemd.stop(id)
+
+    def kill(self, id, sig):
+        self.systemd.kill(id, sig)
+
+    def copy_storage(self, src_id, dst_id, deadline):
+        copy_storage(src_id, dst_id, deadline)
+
+    def swap_storage(self, dst_id):
+        swap_storage(dst_id)
+
+    def discard_storage_copy(self, dst_id):
+        discard_storage_copy(dst_id)
+
+
+class AgentHost:
+    """Runners on another host, controlled through jorm_agent.py running there
+
+    Runners of an agent, which doesn't answer for longer than agent_unreachable, are reported as unreachable.
+    """
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        # unit states and actions are traced by Hosts
+        self.__session = Transport(http_config('connect_timeout', 1), http_config('read_timeout', 3),
+                                   target=f'agent_{urlsplit(self.url).netloc}', traced=False)
+        self.__headers = {'Authorization': f'Bearer {config["agent_token"]}'} if config.get('agent_token') else {}
+        self.__failing_since = None
+        self.__unreachable = False
+
+    def __call(self, method, path, body=None, read_timeout=None):
+        resp = self.__session.request(method, f'{self.url}{path}', json=body, headers=self.__headers,
+                                      read_timeout=read_timeout or http_config('agent_timeout', 30))
+        if resp.status_code != 200:
+            raise RuntimeError(f'Agent {self.url} failed {method} {path}: {resp.status_code} {resp.text}')
+        return resp.json()
+
+    def units(self, ids):
+        """Return dict of unit states for given runner ids, unknown while the agent doesn't answer for a while
+        """
+        try:
+            res = self.__call('GET', f'/units?ids={",".join(str(id) for id in ids)}',
+                              read_timeout=http_config('read_timeout', 3))
+        except BudgetExceeded:
+            return {id: UNKNOWN_UNIT for id in ids}
+        except Exception:
+            if self.__failing_since is None:
+                self.__failing_since = monotonic()
+                logger.warning(f'Agent {self.url} is not responding')
+            if monotonic() - self.__failing_since < config.get('agent_unreachable', 10):
+                return {id: UNKNOWN_UNIT for id in ids}
+            if not self.__unreachable:
+                logger.error(f'Agent {self.url} is unreachable, its runners are probed only over REST api')
+                self.__unreachable = True
+            return {id: UNREACHABLE_UNIT for id in ids}
+
+        if self.__failing_since is not None:
+            logger.info(f'Agent {self.url} is responding again')
+            self.__failing_since = None
+            self.__unreachable = False
+        # the agent reports uptime of the units, as monotonic clocks of the hosts differ
+        now = monotonic()
+        return {id: Unit(res[str(id)][0], now - res[str(id)][1] if res[str(id)][1] else 0) for id in ids}
+
+    def restart(self, id):
+        self.__call('POST', f'/units/{id}/restart')
+
+    def stop(self, id):
+        self.__call('POST', f'/units/{id}/stop')
+
+    def kill(self, id, sig):
+        self.__call('POST', f'/units/{id}/kill', {'signal': int(sig)})
+
+    def copy_storage(self, src_id, dst_id, deadline):
+        seconds = deadline - monotonic()
+        self.__call('POST', f'/storage/{dst_id}/copy', {'src': src_id, 'seconds': seconds},
+                    read_timeout=max(seconds, 0) + http_config('agent_timeout', 30))
+
+    def swap_storage(self, dst_id):
+        self.__call('POST', f'/storage/{dst_id}/swap')
+
+    def discard_storage_copy(self, dst_id):
+        self.__call('POST', f'/storage/{dst_id}/discard')
+
+
+class Hosts:
+    """Route control of the runners to the hosts they run on, states of units are queried from all hosts at once
+    """
+    def __init__(self, hosts):
+        self.__hosts = hosts  # runner id -> host
+        cnt_hosts = len(set(hosts.values()))
+        self.__pool = ThreadPoolExecutor(max_workers=max(cnt_hosts, 1), thread_name_prefix='jorm_hosts')
+
+    def same_host(self, a, b):
+        """Are runners a and b on the same host?
+        """
+        return self.__hosts[a] is self.__hosts[b]
+
+    def units(self, ids):
+        asked = time()
+        groups = {}
+        for id in ids:
+            groups.setdefault(self.__hosts[id], []).append(id)
+        if len(groups) == 1:
+            host, host_ids = next(iter(groups.items()))
+            return self.__traced(host.units(host_ids), asked)
+
+        # the HTTP budget of the calling thread applies to the queries as well
+        deadline = getattr(http_deadline, 'value', None)
+
+        def query(group):
+            with budget_until(deadline):
+                return group[0].units(group[1])
+
+        res = {}
+        for units in self.__pool.map(query, groups.items()):
+            res.update(units)
+        return self.__traced(res, asked)
+
+    @staticmethod
+    def __traced(units, asked):
+        """Record unit states in the trace, with uptime, as the monotonic clock differs on a replay
+        """
+        if tracer.enabled():
+            now = monotonic()
+            for id, u in units.items():
+                tracer.record('unit', id, [u.state, now - u.since if u.since else 0], asked)
+        return units
+
+    def restart(self, id):
+        tracer.record('action', f'restart {id}', None)
+        self.__hosts[id].restart(id)
+
+    def stop(self, id):
+        tracer.record('action', f'stop {id}', None)
+        self.__hosts[id].stop(id)
+
+    def kill(self, id, sig):
+        tracer.record('action', f'kill {id}', int(sig))
+        self.__hosts[id].kill(id, sig)
+
+    def copy_storage(self, src_id, dst_id, deadline):
+        self.__hosts[dst_id].copy_storage(src_id, dst_id, deadline)
+
+    def swap_storage(self, dst_id):
+        self.__hosts[dst_id].swap_storage(dst_id)
+
+    def discard_storage_copy(self, dst_id):
+        self.__hosts[dst_id].discard_storage_copy(dst_id)
+
+
+def hosts_backend(runners, systemd=None):
+    """Return Hosts controlling the runners, local runners are controlled by the systemd backend (default from config)
+    """
+    local = None
+    agents = {}
+    hosts = {}
+    for r in runners:
+        if r.agent is None:
+            local = local or LocalHost(systemd or systemd_backend())
+            hosts[r.id] = local
+        else:
+            if r.agent not in agents:
+                agents[r.agent] = AgentHost(r.agent)
+            hosts[r.id] = agents[r.agent]
+    return Hosts(hosts)
+
+
+STATE_VERSION = 1
+
+
+def read_state(path):
+    """Return the saved state of the master, or None if unavailable or incompatible
+    """
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning(f'Cannot read state file {path}, starting cold')
+        return None
+
+    if state.get('version') != STATE_VERSION or state.get('genesis') != config['pooltool']['genesis']:
+        logger.warning(f'State file {path} is not compatible, starting cold')
+        return None
+    return state
+
+
+def write_state(path, state):
+    """Save the state of the master, the file is replaced atomically so a crash never leaves it half written
+    """
+    tmp = f'{path}.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump({'version': STATE_VERSION, 'genesis': config['pooltool']['genesis'], **state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except Exception:
+        logger.warning(f'Cannot write state file {path}')
+
+
+class Scheduler:
+    """Run named tasks at their deadlines on the monotonic clock
+
+    Scheduling a task again replaces its previous deadline. Tasks can be scheduled from other threads.
+    """
+    def __init__(self, clock=monotonic):
+        self.__clock = clock
+        self.__heap = []   # (deadline, seq, name), may contain outdated entries
+        self.__tasks = {}  # name -> (heap entry, func)
+        self.__seq = count()
+        self.__cond = Condition()
+
+    def schedule(self, name, deadline, func):
+        """(Re)schedule task to run at the monotonic deadline
+        """
+        with self.__cond:
+            entry = (deadline, next(self.__seq), name)
+            self.__tasks[name] = (entry, func)
+            heappush(self.__heap, entry)
+            self.__cond.notify()
+
+    def schedule_in(self, name, delay, func):
+        """(Re)schedule task to run after delay in seconds
+        """
+        self.schedule(name, self.__clock() + delay, func)
+
+    def schedule_at(self, name, unix_time, func):
+        """(Re)schedule task to run at the wall clock time
+        """
+        self.schedule_in(name, unix_time - time(), func)
+
+    def cancel(self, name):
+        """Remove task from the schedule, if scheduled
+        """
+        with self.__cond:
+            self.__tasks.pop(name, None)
+
+    def next_deadline(self):
+        """Return monotonic deadline of the first scheduled task, or None if there is none
+        """
+        with self.__cond:
+            return min((entry[0] for entry, _ in self.__tasks.values()), default=None)
+
+    def deadline(self, name):
+        """Return monotonic deadline of the task, or None if not scheduled
+        """
+        with self.__cond:
+            task = self.__tasks.get(name)
+            return task[0][0] if task else None
+
+    def __pop_due(self):
+        """Return (func, None) of the first due task, or (None, time to wait) if there is no due task
+        """
+        while self.__heap:
+            entry = self.__heap[0]
+            task = self.__tasks.get(entry[2])
+            if task is None or task[0] is not entry:
+                heappop(self.__heap)  # cancelled or rescheduled
+                continue
+            wait = entry[0] - self.__clock()
+            if wait > 0:
+                return None, wait
+            heappop(self.__heap)
+            del self.__tasks[entry[2]]
+            return task[1], None
+        return None, None
+
+    def run_once(self, block=True):
+        """Run the first due task, wait for it if block, return False if nothing was run
+        """
+        with self.__cond:
+            while True:
+                func, wait = self.__pop_due()
+                if func is not None:
+                    break
+                if not block:
+                    return False
+                self.__cond.wait(wait)
+        func()
+        return True
+
+    def run(self):
+        """Run the tasks forever
+        """
+        while True:
+            self.run_once()
 
 
 class Master:
-    def __init__(self, cnt_runners):
-        self.__runners = [Runner(i) for i in range(cnt_runners)]
+    def __init__(self, cnt_runners, systemd=None, state_file=None):
+        """Runners are defined by the config (see runner_configs), systemd overrides the backend of local runners
+
+        E.g. jorm_sim.SimSystemd controls simulated runners instead of systemd units, for simulations and tests.
+        """
+        runners = runner_configs(cnt_runners)
+        self.__hosts = hosts_backend(runners, systemd)
+        self.__runners = [Runner(r.id, self.__hosts, r.rest) for r in runners]
+        # one worker per runner, so a single unresponsive runner doesn't delay the others
+        self.__pool = ThreadPoolExecutor(max_workers=len(runners), thread_name_prefix='jorm_poll')
         self.__block_0_time = None
         self.__slot_duration = None
         self.__slots_per_epoch = None
         self.__epoch = None
         self.__epoch_end_time = None
-        self.__leader_events = []
+        self.__schedule = LeaderSchedule()
         self.__epoch_events_known = False
+        self.__next_probe = {r.id: 0 for r in self.__runners}  # monotonic time of the next probe
+        self.__stable = {r.id: 0 for r in self.__runners}      # number of consecutive probes without an anomaly
+        # leadership changes are frozen until this time during an event
+        self.__frozen_until = None
+        self.__epoch_rollover = False
+        self.__suspended = []
+        self.__planner = BootPlanner(config['start_before_event'], config.get('boot_contention', 0.5),
+                                     config['event_action'])
+        self.__planned = {}  # runner id -> planned (re)start time, None if not possible in the current epoch
+        # runners busy with copying of storage, they are neither probed nor managed
+        self.__busy = set()
+        self.__cloner = ThreadPoolExecutor(max_workers=1, thread_name_prefix='jorm_clone')
+        self.on_clone_done = None  # called by the clone thread when a copy of storage finishes
+        self.__secret = None  # node secret serialized to JSON, read only once
+        # standby pool: the leader and this many synced passive runners are kept running, None keeps all the runners
+        # running; spares are further runners started ahead in free windows of the planner, the rest is stopped
+        self.__standby = config.get('standby')
+        self.__spares = config.get('spares') or 0
+        if self.__standby is not None:
+            self.__node_secret()  # staged for an instant promotion of a standby runner
+        # manual interventions over the status API, drained runners are handed off and kept stopped
+        self.__drained = frozenset()  # replaced on change, as it is read by the status API
+        self.__preferred = None       # runner id preferred as the leader, while it is synced
+        # reference height for detecting stuck runners, further sources can be added, e.g. peer nodes
+        self.reference = HeightReference(reference_config('half_life', 60), reference_config('outlier', 100))
+        self.__pooltool = (0, None)  # majority max and its age, given to restart_stuck
+        self.__pooltool_moved = None  # monotonic time of the last change of the majority max
+        trust = reference_config('trust', {})
+        self.reference.add_source('runners', self.__runner_heights, trust.get('runners', 1.0), local=True)
+        self.reference.add_source('pooltool', lambda: {None: self.__pooltool}, trust.get('pooltool', 0.8))
+        # the height restored from the saved state is needed only until the live sources catch up with it,
+        # it is as old as the state and trusted less than the live sources
+        self.reference.add_source('state', self.__restored_height, trust.get('state', 0.5))
+        # warm start from the saved state, which is verified against the runners once one of them is running
+        self.__state_file = state_file
+        self.__state_verified = True
+        self.__restored_max = 0
+        self.__restored_at = None  # unix time, when the restored state was saved
+        state = read_state(state_file) if state_file else None
+        if state is not None:
+            self.__restore(state)
+
+    def __restore(self, state):
+        """Restore settings, epoch, leader events and last known height from the saved state
+        """
+        try:
+            self.__block_0_time, self.__slot_duration, self.__slots_per_epoch = state['settings']
+            if state['epoch_end_time'] > time():
+                self.__epoch = state['epoch']
+                self.__epoch_end_time = state['epoch_end_time']
+                self.__schedule = LeaderSchedule(state['leader_events'], self.__epoch_end_time)
+                self.__epoch_events_known = state['events_known']
+            self.__restored_max = max(state['heights'].values(), default=0)
+            self.__restored_at = state.get('saved_at')
+            self.__planner.durations = {int(id): d for id, d in state.get('boot_durations', {}).items()}
+        except Exception:
+            logger.warning('Cannot restore the saved state, starting cold')
+            self.__block_0_time = self.__slot_duration = self.__slots_per_epoch = None
+            self.__epoch = self.__epoch_end_time = None
+            self.__schedule = LeaderSchedule()
+            self.__epoch_events_known = False
+            return
+
+        self.__state_verified = False
+        logger.info(f'Restored saved state: epoch {self.__epoch}, {len(self.__schedule)} leader events, '
+                    f'height {self.__restored_max}')
+
+    def save_state(self):
+        """Save settings, epoch, leader events and last known heights to the state file
+        """
+        if self.__state_file is None or self.__slots_per_epoch is None:
+            return
+
+        write_state(self.__state_file, {
+            'settings': [self.__block_0_time, self.__slot_duration, self.__slots_per_epoch],
+            'epoch': self.__epoch,
+            'epoch_end_time': self.__epoch_end_time or 0,
+            'leader_events': self.__schedule.events,
+            'events_known': self.__epoch_events_known,
+            'heights': {str(s.id): s.height for s in self.snapshots()},
+            'boot_durations': {str(id): d for id, d in self.__planner.durations.items()},
+            'saved_at': time(),
+        })
+
+    def __restored_height(self):
+        """Return the height restored from the saved state and its age, a source of the reference
+        """
+        age = time() - self.__restored_at if self.__restored_at is not None else None
+        return {None: (self.__restored_max, age)}
+
+    def __runner_on(self):
+        """Return the first running runner, or None if there is none
+        """
+        for r, status in zip(self.__runners, self.stats()):
+            if status == Status.ON:
+                return r
+        return None
+
+    def state_verified(self):
+        return self.__state_verified
+
+    def verify_state(self):
+        """Check the restored settings and leader events against a running node
+        """
+        runner_on = self.__runner_on()
+        if runner_on is None:
+            return
+        settings = runner_on.settings()
+        if settings is None:
+            return
+
+        if settings != (self.__block_0_time, self.__slot_duration, self.__slots_per_epoch):
+            logger.warning('Restored settings differ from the runners, reloading')
+            self.__block_0_time, self.__slot_duration, self.__slots_per_epoch = settings
+            self.__epoch = None
+            self.__epoch_end_time = None
+            self.__epoch_events_known = False
+        elif self.__epoch_events_known:
+            events = runner_on.leader_events()
+            if events and sorted(events) != self.__schedule.events:
+                logger.warning('Restored leader events differ from the runners, reloading')
+                self.__epoch_events_known = False
+
+        self.__state_verified = True
+        self.save_state()
+
+    def __poll(self, func, runners=None):
+        """Call func on given (default all) runners concurrently, return list of results in order of runners
+
+        The HTTP budget of the calling thread applies to the calls as well
+        """
+        deadline = getattr(http_deadline, 'value', None)
+
+        def call(r):
+            with budget_until(deadline):
+                return func(r)
+
+        return list(self.__pool.map(call, self.__runners if runners is None else runners))
+
+    def budget(self):
+        """Return time budget for REST requests of a cycle, it is tighter close to an event
+        """
+        closest = self.__closest_event(epoch_roll=True)
+        if self.frozen() or (closest is not None and closest - time() < config['event_action']):
+            return http_config('event_budget', 1)
+        return http_config('cycle_budget', 5)
+
+    def refresh(self, runners=None):
+        """Concurrently take a new snapshot of given (default all) runners, decisions are based on them
+        """
+        runners = self.__runners if runners is None else runners
+        try:
+            # states of all units are read at once, the node REST APIs are queried concurrently
+            with metrics.timer('jorm_systemd_call_seconds', call='units'):
+                units = self.__hosts.units([r.id for r in runners])
+        except Exception:
+            logger.error('Cannot read state of runners from systemd, keeping the last snapshots')
+            return
+        self.__poll(lambda r: r.poll(units[r.id]), runners)
+
+    # number of consecutive stable probes, after which the probe interval of a runner is doubled
+    STABLE_PROBES = 10
+
+    def __update_stability(self, prev, s, max_height):
+        """Count consecutive probes, where the runner kept running, was in sync and answered
+        """
+        stable = (prev.status == s.status == Status.ON and s.taken != prev.taken and s.height >= max_height - 1)
+        self.__stable[s.id] = self.__stable[s.id] + 1 if stable else 0
+
+    def __probe_interval(self, snapshot):
+        """Return time until the next probe of a runner
+
+        Probes are dense right before an event and aligned just after slot starts, when a new block can appear.
+        They back off in long gaps without events, while bootstrapping, and for runners stable for a while.
+        """
+        if snapshot.status == Status.BOOT:
+            return config.get('probe_boot', 10)
+
+        interval = config.get('probe_leader', 1) if snapshot.leader else config.get('probe_interval', 3)
+        closest = self.__closest_event(epoch_roll=True)
+        if closest is None:
+            return interval  # the schedule is unknown, nothing to adapt to
+
+        dense_from = closest - 2 * config['event_action']
+        if time() >= dense_from:
+            return min(interval, config.get('probe_event', 0.5))
+
+        interval *= 1 + min(self.__stable[snapshot.id], self.STABLE_PROBES) / self.STABLE_PROBES
+        if closest - time() > config.get('probe_idle_gap', 600):
+            interval *= 2
+        interval = min(interval, config.get('probe_max', 10), dense_from - time())
+
+        # probe right after the start of a slot, so a new block is seen as soon as possible
+        if self.__slot_duration and interval >= self.__slot_duration:
+            t = time() + interval
+            slot_start = self.__block_0_time + (t - self.__block_0_time) // self.__slot_duration * self.__slot_duration
+            aligned = slot_start + config.get('probe_slot_offset', 0.5) - time()
+            interval = aligned if aligned > 0 else interval
+        return interval
+
+    def probe(self):
+        """Take new snapshots of runners which are due for a probe
+
+        Return True if status, height or leadership of any runner changed
+        """
+        for r in self.__runners:
+            if r.id in self.__busy:
+                # not probed while copying storage, probed right away once the copy finishes
+                self.__next_probe[r.id] = monotonic() + config.get('probe_max', 10)
+        due = [r for r in self.__runners if self.__next_probe[r.id] <= monotonic()]
+        before = [r.snapshot() for r in due]
+        if due:
+            self.refresh(due)
+
+        changed = False
+        max_height = max(self.heights())
+        for r, prev in zip(due, before):
+            s = r.snapshot()
+            self.__update_stability(prev, s, max_height)
+            self.__next_probe[r.id] = monotonic() + self.__probe_interval(s)
+            metrics.set('jorm_runner_status', int(s.status), runner=r.id)
+            metrics.set('jorm_runner_leader', int(s.leader), runner=r.id)
+            last_block = self.__last_block(r)
+            if last_block is not None:
+                metrics.set('jorm_runner_last_block_time', last_block, runner=r.id)
+            rate = r.history.rate(config.get('stall_window', 600), monotonic())
+            if rate is not None:
+                metrics.set('jorm_runner_blocks_per_second', rate, runner=r.id)
+            if prev.status == Status.BOOT and s.status == Status.ON and s.service_uptime:
+                self.__planner.record(r.id, s.service_uptime)
+                logger.info(f'Jormungandr runner {r.id} bootstrapped in {s.service_uptime:.0f} s',
+                            **self.__fields(runner=r.id, height=s.height))
+            changed = changed or (s.status, s.height, s.leader) != (prev.status, prev.height, prev.leader)
+        return changed
+
+    @staticmethod
+    def __last_block(r):
+        """Return unix time of the last tip change of a runner, or None if unknown
+        """
+        last_change = r.history.last_change()
+        return time() - (monotonic() - last_change) if last_change is not None else None
+
+    def next_probe(self):
+        """Return monotonic time when the next runner is due for a probe
+        """
+        return min(self.__next_probe.values())
+
+    def snapshots(self):
+        """Return list with the last snapshot of each runner
+        """
+        return [r.snapshot() for r in self.__runners]
+
+    def status(self):
+        """Return the master's view of the cluster, from memory only, so it can be called from other threads
+        """
+        now = time()
+        snapshots = self.snapshots()
+        last_blocks = [self.__last_block(r) for r in self.__runners]
+        return {
+            'time': now,
+            'epoch': self.__epoch,
+            'epoch_end': self.__epoch_end_time,
+            'epoch_end_in': self.__epoch_end_time - now if self.__epoch_end_time is not None else None,
+            'reference_height': self.reference.height,
+            'frozen_until': self.__frozen_until,
+            'leaders': [s.id for s in snapshots if s.status == Status.ON and s.leader],
+            'preferred': self.__preferred,
+            'drained': sorted(self.__drained),
+            'standby': self.__standby,
+            'runners': [{'id': s.id, 'status': s.status.name, 'height': s.height, 'uptime': s.uptime,
+                         'leader': s.leader, 'unit': s.unit, 'service_uptime': round(s.service_uptime),
+                         'tip': s.tip, 'age': round(now - s.taken, 3), 'busy': s.id in self.__busy,
+                         'planned_start': self.__planned.get(s.id), 'last_block': last_block,
+                         'blocks_per_second': rate}
+                        for s, last_block, rate in zip(snapshots, last_blocks, self.velocity())],
+            'schedule': [{'time': e, 'in': round(e - now, 3)} for e in self.__schedule.events if e > now],
+        }
 
     def settings_loaded(self):
         """From epoch_end_time determine if the settings for current epoch are loaded
@@ -311,55 +2000,69 @@ class Master:
     def load_settings(self):
         """Load general settings and compute epoch and epoch_end_time
         """
-        runner_on = None
-        for r in self.__runners:
-            if r.status() == Status.ON:
-                runner_on = r
-                break
-        if runner_on is None:
-            return
-
-        if self.__block_0_time is None:
-            self.__block_0_time = runner_on.block_0_time()
-        if self.__slot_duration is None:
-            self.__slot_duration = runner_on.slot_duration()
         if self.__slots_per_epoch is None:
-            self.__slots_per_epoch = runner_on.slots_per_epoch()
+            runner_on = self.__runner_on()
+            settings = runner_on.settings() if runner_on is not None else None
+            if settings is None:
+                return
+            self.__block_0_time, self.__slot_duration, self.__slots_per_epoch = settings
+
         if self.__epoch is None:
             self.__epoch = int((time() - self.__block_0_time) / (self.__slot_duration * self.__slots_per_epoch))
-            logger.info(f'The current epoch is {self.__epoch}')
+            logger.info(f'The current epoch is {self.__epoch}', **self.__fields())
         if self.__epoch_end_time is None:
             self.__epoch_end_time = (self.__epoch + 1) * self.__slot_duration * self.__slots_per_epoch + self.__block_0_time - 1
-            logger.info(f'The current epoch {self.__epoch} ends at {datetime.fromtimestamp(self.__epoch_end_time)}')
+            logger.info(f'The current epoch {self.__epoch} ends at {datetime.fromtimestamp(self.__epoch_end_time)}',
+                        **self.__fields())
+            self.save_state()
 
     def events_known(self):
         return self.__epoch_events_known
 
-    def __upcoming_events(self, epoch_roll=False):
-        """Return list of upcoming events
+    def schedule(self):
+        """Return the leader schedule, rebuilt only when the leader events or the epoch end change
         """
-        res = [e for e in self.__leader_events if e > time()]
-        if epoch_roll and self.__epoch_end_time is not None:
-            res += [self.__epoch_end_time]
-        return res
+        if self.__schedule.epoch_end != self.__epoch_end_time:
+            metrics.inc('jorm_cache_requests_total', cache='schedule', result='miss')
+            self.__schedule = LeaderSchedule(self.__schedule.events, self.__epoch_end_time)
+        else:
+            metrics.inc('jorm_cache_requests_total', cache='schedule', result='hit')
+        return self.__schedule
 
     def __closest_event(self, epoch_roll=False):
         """Return time of the closest upcoming event, or None if unavailable
         """
-        upcoming_events = self.__upcoming_events(epoch_roll)
-        return min(upcoming_events) if upcoming_events else None
+        return self.schedule().next_event(time(), epoch_roll)
 
     def __log_leader_events(self):
-        """Write to logs schedule of upcoming leader events
+        """Write to logs schedule of upcoming leader events, in a single message
+        """
+        events = self.schedule().upcoming(time(), epoch_roll=False)
+        if events:
+            logger.info(f'Upcoming {len(events)} leader events at '
+                        f'{", ".join(datetime.fromtimestamp(e).strftime("%H:%M:%S") for e in events)}',
+                        **self.__fields(event=events[0]))
+        else:
+            logger.info('No upcoming leader events', **self.__fields())
+
+    def __fields(self, runner=None, height=None, event=None):
+        """Return keyword arguments of a log call with structured journal fields (runner id, height, epoch, slot)
         """
-        events = sorted(self.__upcoming_events(epoch_roll=False))
-        for i, e in enumerate(events):
-            logger.info(f'Upcoming event: {i} at {datetime.fromtimestamp(e)}')
+        fields = {}
+        if runner is not None:
+            fields['RUNNER_ID'] = runner
+        if height is not None:
+            fields['HEIGHT'] = height
+        if self.__epoch is not None:
+            fields['EPOCH'] = self.__epoch
+        if event is not None and self.__slot_duration:
+            fields['SLOT'] = int((event - self.__block_0_time) / self.__slot_duration) % self.__slots_per_epoch
+        return {'extra': fields}
 
     def cnt_events(self, only_future=True, epoch_roll=False):
         """Return number of events scheduled
         """
-        return len(self.__upcoming_events(epoch_roll)) if only_future else len(self.__leader_events)
+        return self.schedule().cnt_upcoming(time(), epoch_roll) if only_future else len(self.__schedule)
 
     def load_leader_events(self):
         """Load leader events
@@ -369,50 +2072,170 @@ class Master:
 
         epoch_start = self.__epoch * self.__slot_duration * self.__slots_per_epoch + self.__block_0_time
 
-        for r in self.__runners:
-            if r.status() == Status.ON:
+        for r, status in zip(self.__runners, self.stats()):
+            if status == Status.ON:
                 events = r.leader_events()
                 if len(events) == 0:
                     return
                 # check if events are from the current epoch
                 if epoch_start <= max(events) <= self.__epoch_end_time:
-                    self.__leader_events = events
+                    self.__schedule = LeaderSchedule(events, self.__epoch_end_time)
                     self.__epoch_events_known = True
                     self.__log_leader_events()
+                    self.save_state()
                     return
 
     def stats(self):
         """Return list with status of each runner
         """
-        return [r.status() for r in self.__runners]
+        return [s.status for s in self.snapshots()]
 
     def heights(self):
         """Return list with block heights of each runner
         """
-        return [r.height() for r in self.__runners]
+        return [s.height for s in self.snapshots()]
 
     # def start_runner(self, id):
     #     """Start a Jormungandr runner
     #     """
     #     self.__runners[id].restart()
 
+    def __start_planned(self, candidates, reasons=None, recover=False):
+        """(Re)start those of the candidate runners, whose planned start has come
+
+        reasons is a dict of runner id -> warning logged when the runner is (re)started,
+        with recover the runners are restarted from a copy of the best runner's storage if possible
+        """
+        reasons = reasons or {}
+        snapshots = self.snapshots()
+        if not any(s.status == Status.ON for s in snapshots):
+            # without a running runner there is nothing to protect
+            plan = {r.id: time() for r in candidates}
+        else:
+            booting = {s.id: s.service_uptime for s in snapshots if s.status == Status.BOOT}
+            plan = self.__planner.plan(self.schedule(), time(), [r.id for r in candidates], booting)
+
+        for r in candidates:
+            planned = plan[r.id]
+            if planned is not None and planned <= time():
+                if r.id in reasons:
+                    logger.warning(reasons[r.id], **self.__fields(runner=r.id, height=r.snapshot().height))
+                if recover:
+                    self.__recover(r)
+                else:
+                    r.restart()
+                self.__planned.pop(r.id, None)
+                continue
+
+            if r.id not in self.__planned or not self.__same_plan(self.__planned[r.id], planned):
+                when = datetime.fromtimestamp(planned) if planned is not None else 'after the epoch end'
+                logger.info(f'Jormungandr runner {r.id} (re)start planned at {when}', **self.__fields(runner=r.id))
+            self.__planned[r.id] = planned
+
+    @staticmethod
+    def __same_plan(a, b):
+        return a == b or (a is not None and b is not None and abs(a - b) < 60)
+
+    def next_start(self):
+        """Return time of the next planned runner (re)start, or None if there is none
+        """
+        planned = [t for t in self.__planned.values() if t is not None]
+        return min(planned) if planned else None
+
     def start_stopped_runners(self):
-        """Start all runners, that are currently stopped
+        """Start runners, that are currently stopped, when they can finish bootstrapping before the next event
+
+        With the standby pool only as many runners are started, as the pool lacks ready or bootstrapping ones.
+        Missing standby runners are planned into the next gap between events, spares are started only when
+        the planner sees a free window for their bootstrap right now.
         """
+        if self.frozen():
+            return
+
+        stopped = [r for r, status in zip(self.__runners, self.stats())
+                   if status == Status.OFF and r.id not in self.__busy and r.id not in self.__drained]
+        if self.__standby is not None:
+            stopped = sorted(stopped, key=lambda r: self.__planner.duration(r.id))
+            missing_standby, missing_spares = self.__pool_missing()
+            spares = stopped[missing_standby:missing_standby + missing_spares]
+            stopped = stopped[:missing_standby]
+            if spares:
+                booting = {s.id: s.service_uptime for s in self.snapshots() if s.status == Status.BOOT}
+                plan = self.__planner.plan(self.schedule(), time(), [r.id for r in stopped + spares], booting)
+                stopped += [r for r in spares if plan[r.id] is not None and plan[r.id] <= time()]
         for r in self.__runners:
-            if r.status() == Status.OFF:
-                r.restart()
-                sleep(0.5)
+            if r not in stopped and r.snapshot().status != Status.ON:
+                self.__planned.pop(r.id, None)
+        self.__start_planned(stopped)
+
+    def __ready(self):
+        """Return ids of runners ready to be promoted: running, not busy and synced with the best one
+        """
+        snapshots = self.snapshots()
+        max_height = max(s.height for s in snapshots)
+        return {s.id for s in snapshots if s.status == Status.ON and s.id not in self.__busy and
+                s.id not in self.__drained and max_height - s.height <= config['max_offset']}
+
+    def __pool_missing(self):
+        """Return tuple (missing standby runners, missing spares) of the pool, bootstrapping runners are counted in
+        """
+        ready = self.__ready()
+        metrics.set('jorm_standby_ready', len(ready))
+        coming = [s for s in self.snapshots() if s.id not in ready and (s.status == Status.BOOT or s.id in self.__busy)]
+        have = len(ready) + len(coming)
+        missing_standby = max(1 + self.__standby - have, 0)
+        return missing_standby, max(1 + self.__standby + self.__spares - have, 0) - missing_standby
+
+    def trim_standby(self):
+        """Stop runners over the standby pool and its spares, once it is complete, the least preferred first
+
+        The leader is never stopped, runners which aren't ready are stopped before the ready ones.
+        """
+        if self.__standby is None or self.frozen():
+            return
+
+        ready = self.__ready()
+        surplus = len(ready) - 1 - self.__standby - self.__spares
+        if surplus < 0:
+            return
+        snapshots = self.snapshots()
+        for i in reversed(self.__runners_sorted()):
+            r, s = self.__runners[i], snapshots[i]
+            if s.status == Status.OFF or s.leader or r.id in self.__busy:
+                continue
+            if r.id not in ready:
+                logger.info(f'Stopping Jormungandr runner {r.id}, the standby pool is complete',
+                            **self.__fields(runner=r.id, height=s.height))
+                r.stop()
+            elif surplus > 0:
+                logger.info(f'Stopping Jormungandr runner {r.id}, over the standby pool and its spares',
+                            **self.__fields(runner=r.id, height=s.height))
+                r.stop()
+                surplus -= 1
 
     def __runners_sorted(self):
         """Return list of runner indexes sorted by their preference (best at index 0)
+
+        Runners are probed at different times, so heights within max_offset of the best one count as synced,
+        and a synced leader keeps its rank over a runner probed right after a new block.
         """
+        snapshots = self.snapshots()
+        max_height = max(s.height for s in snapshots)
+
+        def synced(i):
+            return max_height - snapshots[i].height <= config['max_offset']
+
         # Sort indexes of all runners by their preference
         return sorted(range(len(self.__runners)),
-                      key=lambda i: (self.__runners[i].status() == Status.ON,     # 1) is running
-                                     self.__runners[i].height(),                  # 2) height
-                                     self.__runners[i].is_leader(),               # 3) is leader
-                                     self.__runners[i].status() == Status.BOOT),  # 4) is bootstrapping
+                      key=lambda i: (self.__runners[i].id not in self.__busy,     # 0) isn't copying storage
+                                     self.__runners[i].id not in self.__drained,  # 1) isn't drained
+                                     snapshots[i].status == Status.ON,            # 2) is running
+                                     self.__runners[i].id == self.__preferred and synced(i),  # 3) is preferred
+                                     synced(i),                                   # 4) is synced
+                                     snapshots[i].leader,                         # 5) is leader
+                                     snapshots[i].height,                         # 6) height
+                                     self.__runners[i].history.last_change() or 0,  # 7) freshness of the tip
+                                     snapshots[i].status == Status.BOOT),         # 8) is bootstrapping
                       reverse=True)
 
     # def one_runner(self):
@@ -428,81 +2251,322 @@ class Master:
     #     if r.status() == Status.ON and not r.is_leader():
     #         r.promote()
 
+    def frozen(self):
+        """Are leadership changes frozen because of a close event?
+        """
+        return self.__frozen_until is not None
+
     def handle_near_events(self):
-        """Prepare for the upcoming events
+        """Prepare for the upcoming events, and finish the preparation when the event has passed
+
+        Bootstrapping runners are suspended and leadership changes are frozen until the event passes
         """
-        if self.cnt_events(only_future=True, epoch_roll=True) <= 0:
+        if self.frozen():
+            if time() >= self.__frozen_until:
+                self.__event_passed()
+            return
+
+        closest = self.__closest_event(epoch_roll=True)
+        if closest is None:
             return
 
-        time_remaining = self.__closest_event(epoch_roll=True) - time()
+        time_remaining = closest - time()
 
         if time_remaining < config['event_action']:
-            booting_nodes = [r for r in self.__runners if r.status() == Status.BOOT]
-            epoch_rollover = self.__epoch_end_time is not None and self.__epoch_end_time - time() < config['event_action']
+            self.__suspended = [r for r, status in zip(self.__runners, self.stats())
+                                if status == Status.BOOT and r.id not in self.__busy]
+            self.__epoch_rollover = self.__epoch_end_time is not None and self.__epoch_end_time - time() < config['event_action']
 
             # Suspend bootstrapping runners
-            for r in booting_nodes:
+            for r in self.__suspended:
                 r.suspend()
 
             # Promote all nodes for epoch rollover
-            if epoch_rollover:
-                logger.info(f'Preparing for an epoch rollover, promoting all runners')
-                for r in self.__runners:
-                    if r.status() == Status.ON and not r.is_leader():
-                        r.promote()
+            if self.__epoch_rollover:
+                logger.info('Preparing for an epoch rollover, promoting all runners', **self.__fields(event=closest))
+                for r, s in zip(self.__runners, self.snapshots()):
+                    if s.status == Status.ON and not s.leader:
+                        r.promote(self.__node_secret())
 
             # Update remaining time
             time_remaining = self.__closest_event(epoch_roll=True) - time()
 
-            # Sleep through the event
-            logger.info(f'Preparing for a close event in {time_remaining:.2f} seconds, hibernating')
-            sleep(time_remaining + 2)
-            logger.info(f'Woke up')
+            # Freeze leadership changes until the event passes, runners are still monitored
+            logger.info(f'Preparing for a close event in {time_remaining:.2f} seconds, freezing leadership changes',
+                        **self.__fields(event=closest))
+            self.__frozen_until = time() + time_remaining + 2
 
-            for r in booting_nodes:
-                r.resume()
+    def __event_passed(self):
+        """Resume suspended runners after an event, leadership changes stay frozen for a while after epoch rollover
+        """
+        logger.info('Event passed')
+        for r in self.__suspended:
+            r.resume()
+        self.__suspended = []
+
+        if self.__epoch_rollover:
+            self.__epoch_rollover = False
+            # the epoch settings and leader events are reloaded for the new epoch
+            self.__epoch_events_known = False
+            self.__epoch = None
+            self.__epoch_end_time = None
+            logger.info('Freezing leadership changes for additional 20 s after epoch rollover')
+            self.__frozen_until = time() + 20
+        else:
+            self.__frozen_until = None
 
-            if epoch_rollover:
-                self.__epoch_events_known = False
-                self.__epoch = self.__epoch + 1
-                self.__epoch_end_time = (self.__epoch + 1) * self.__slot_duration * self.__slots_per_epoch + self.__block_0_time - 1
-                logger.info(f'Sleeping for additional 20 s after epoch rollover')
-                sleep(20)
+    def next_event_check(self):
+        """Return time when handle_near_events has something to do, or None if unknown
+        """
+        if self.frozen():
+            return self.__frozen_until
+        closest = self.__closest_event(epoch_roll=True)
+        return closest - config['event_action'] if closest is not None else None
+
+    def __node_secret(self):
+        """Return node secret serialized to JSON, the file is read only once
+        """
+        metrics.inc('jorm_cache_requests_total', cache='node_secret', result='hit' if self.__secret else 'miss')
+        if self.__secret is None:
+            try:
+                with open(config['node_secret'], 'r') as f:
+                    self.__secret = json.dumps(yaml.safe_load(f)).encode('utf-8')
+            except Exception:
+                logger.error(f'Cannot read node secret from {config["node_secret"]}')
+        return self.__secret
+
+    def __handoff(self, old_leaders, new_leader):
+        """Demote old leaders and promote the new one (if any) right after, so there is never more than one leader
+
+        An old leader, that cannot be demoted, is stopped. If it cannot be stopped either, it stays the leader
+        and nobody is promoted, the handoff is retried on the next cycle. Return time without a leader in seconds,
+        or None.
+        """
+        secret = self.__node_secret() if new_leader is not None else None
+        kept = []
+        for r in old_leaders:
+            if r.demote() or r.snapshot().status == Status.OFF:
+                continue
+            logger.error(f'Jormungandr runner {r.id} cannot be demoted, stopping', **self.__fields(runner=r.id))
+            if not r.stop():
+                kept.append(r)
+        demoted = monotonic()
+
+        if kept:
+            logger.error(f'Jormungandr runners {[r.id for r in kept]} can be neither demoted nor stopped, '
+                         f'they stay leaders until the next attempt')
+            return None
+
+        if new_leader is None or secret is None or not new_leader.promote(secret):
+            return None
+        gap = monotonic() - demoted
+        if old_leaders:
+            metrics.observe('jorm_leader_handoff_seconds', gap)
+            logger.info(f'Leadership handed over to Jormungandr runner {new_leader.id}, without a leader for '
+                        f'{gap * 1000:.0f} ms', **self.__fields(runner=new_leader.id, height=new_leader.snapshot().height))
+        return gap
+
+    def __keeps_leadership(self, s, best):
+        """Should the leader keep its leadership instead of handing it over to the best runner?
+
+        A handoff costs REST requests and a moment without a leader, so it happens only when the leader isn't
+        running, is busy or drained, is more than max_offset blocks behind, or another runner is preferred.
+        """
+        return (s.leader and s.status == Status.ON and s.id not in self.__busy and s.id not in self.__drained and
+                best.height - s.height <= config['max_offset'] and
+                (best.id != self.__preferred or s.id == self.__preferred))
 
     def best_leader(self):
-        """Make sure there is exactly one best behaving leader if possible
+        """Make sure there is exactly one best behaving leader if possible, a healthy leader keeps its leadership
         """
-        best_id = self.__runners_sorted()[0]
+        ranked = self.__runners_sorted()
+        snapshots = self.snapshots()
+        best_id = next((i for i in ranked if self.__keeps_leadership(snapshots[i], snapshots[ranked[0]])), ranked[0])
 
-        for r in self.__runners:
-            if r.id != best_id and r.is_leader():
-                r.demote()
+        # During an event, leadership can only be taken over if there is no running leader
+        if self.frozen() and any(s.status == Status.ON and s.leader for s in snapshots):
+            return
 
-        if self.__runners[best_id].status() == Status.ON and not self.__runners[best_id].is_leader():
-            self.__runners[best_id].promote()
+        old_leaders = [r for r, s in zip(self.__runners, snapshots) if r.id != best_id and s.leader]
+        if snapshots[best_id].status == Status.ON and not snapshots[best_id].leader:
+            self.__handoff(old_leaders, self.__runners[best_id])
+        elif old_leaders:
+            self.__handoff(old_leaders, None)
 
-    def __safe_to_start(self):
-        """Is it a safe time to start a new runner?
+    def drain(self, id, drained=True):
+        """Hand the leadership over from the runner and keep it stopped, or return it to service
         """
-        return self.__closest_event(epoch_roll=True) - time() > config['start_before_event']
+        self.__drained = self.__drained | {id} if drained else self.__drained - {id}
+        self.__planned.pop(id, None)
+        logger.info(f'Jormungandr runner {id} {"drained" if drained else "returned to service"}',
+                    **self.__fields(runner=id))
 
-    def restart_stuck(self, pt_max):
-        """Restart stuck runners
+    def prefer(self, id):
+        """Prefer the runner as the leader while it is running and synced, None for no preference
         """
-        known_max = max(self.heights() + [pt_max])
+        self.__preferred = id
+        logger.info(f'Jormungandr runner {id} preferred as the leader' if id is not None else
+                    'No runner preferred as the leader', **self.__fields(runner=id))
 
-        for r in self.__runners:
-            # if the height difference from known maximum exceeded threshold
-            is_stuck = r.status() == Status.ON and known_max - r.height() > config['max_offset']
-            if is_stuck and self.__safe_to_start() and r.uptime() > config['boot_catch_up']:
-                logger.warning(f'Jormungandr runner {r.id} is stuck, local: {r.height()}, known max: {known_max}')
-                r.restart()
-                sleep(0.5)
+    def stop_drained(self):
+        """Stop drained runners, once they aren't leaders
+        """
+        if self.frozen():
+            return
+        for r, s in zip(self.__runners, self.snapshots()):
+            if r.id in self.__drained and s.status != Status.OFF and not s.leader and r.id not in self.__busy:
+                r.stop()
+
+    def velocity(self):
+        """Return list with block rate (blocks per second) of each runner, None if unknown
+        """
+        now = monotonic()
+        return [r.history.rate(config.get('stall_window', 600), now) for r in self.__runners]
+
+    def __stalled(self):
+        """Return dict of runner id -> reason for runners, whose tip stopped moving or is much slower than the others
+        """
+        now = monotonic()
+        snapshots = self.snapshots()
+        running = [(r, s) for r, s in zip(self.__runners, snapshots) if s.status == Status.ON]
+        rates = {r.id: rate for r, rate in zip(self.__runners, self.velocity())}
+        # rates of freshly (re)started runners include catching up with the chain, they are left out of the median
+        known_rates = sorted(rates[r.id] for r, s in running
+                             if rates[r.id] is not None and s.uptime > config['boot_catch_up'])
+        median = known_rates[len(known_rates) // 2] if known_rates else None
+
+        res = {}
+        for r, s in running:
+            if s.uptime <= config['boot_catch_up'] or r.history.last_change() is None:
+                continue
+
+            # the tip isn't moving, while the other runners are advancing
+            last_change = r.history.last_change()
+            advancing = [p for p, ps in running if p is not r and ps.height > s.height
+                         and (p.history.last_change() or 0) > last_change]
+            if now - last_change > config.get('stall_time', 120) and advancing:
+                res[r.id] = (f'Jormungandr runner {r.id} is stalled, tip unchanged for {now - last_change:.0f} s, '
+                             f'local: {s.height}, runner {advancing[0].id}: {advancing[0].snapshot().height}')
+            # the block rate is much lower than of the rest of the cluster
+            elif len(known_rates) > 2 and rates[r.id] is not None and median > 0 and \
+                    rates[r.id] < median * config.get('stall_rate', 0.5):
+                res[r.id] = (f'Jormungandr runner {r.id} is too slow, {rates[r.id] * 60:.2f} blocks per minute, '
+                             f'median: {median * 60:.2f}')
+
+        # no tip is moving, while PoolTool is advancing
+        pt_max = self.__pooltool[0]
+        idle = [now - (r.history.last_change() or now) for r, _ in running]
+        pt_idle = now - self.__pooltool_moved if self.__pooltool_moved is not None else None
+        if running and cluster_stalled(idle, pt_idle, pt_max - max(s.height for _, s in running)):
+            for r, s in running:
+                res.setdefault(r.id, f'Jormungandr runner {r.id} is stalled with all the runners, tip unchanged '
+                                     f'for {now - r.history.last_change():.0f} s, local: {s.height}, PoolTool: {pt_max}')
+        return res
+
+    def __runner_heights(self):
+        """Return dict of runner id -> (height, age in seconds) of the running runners, a source of the reference
+        """
+        now = time()
+        return {s.id: (s.height, now - s.taken) for s in self.snapshots() if s.status == Status.ON}
+
+    def restart_stuck(self, pt_max, pt_age=None):
+        """Restart stuck runners, pt_max is PoolTool majority max and pt_age its age in seconds
+
+        A runner behind the reference height is restarted only if the sources are confident enough about it.
+        """
+        if self.frozen():
+            return
+
+        snapshots = self.snapshots()
+        if pt_max and pt_age is not None and pt_max != self.__pooltool[0]:
+            self.__pooltool_moved = monotonic() - pt_age
+        self.__pooltool = (pt_max, pt_age)
+        if max([s.height for s in snapshots] + [pt_max]) >= self.__restored_max:
+            self.__restored_max = 0
+        known_max = self.reference.update()
+
+        stuck = {}
+        stalled = self.__stalled()
+        for r, s in zip(self.__runners, snapshots):
+            if r.id in self.__busy or r.id in self.__drained:
+                continue
+
+            # if the height difference from the reference exceeded threshold, and the sources are confident about it
+            confidence = self.reference.behind(s.height, exclude=('runners', r.id)) if s.status == Status.ON else 0
+            if confidence >= reference_config('confidence', 0.5) and s.uptime > config['boot_catch_up']:
+                stuck[r] = (f'Jormungandr runner {r.id} is stuck, local: {s.height}, reference: {known_max}, '
+                            f'confidence: {confidence:.2f}')
+            elif r.id in stalled:
+                stuck[r] = stalled[r.id]
+            elif s.status == Status.ON:
+                self.__planned.pop(r.id, None)
 
             # if the bootstrap process is taking too long
-            if r.status() == Status.BOOT and r.service_uptime() > config['max_boot']:
+            if s.status == Status.BOOT and s.service_uptime > config['max_boot']:
                 logger.warning(f'Jormungandr runner {r.id} is bootstrapping for too long')
-                r.restart()
+                self.__recover(r)
+
+        # restart stuck runners, when they can finish bootstrapping before the next event
+        if stuck:
+            self.__start_planned(list(stuck), {r.id: reason for r, reason in stuck.items()}, recover=True)
+
+    def __clone_source(self, target):
+        """Return the best running runner, which can be suspended to copy its storage, or None
+        """
+        snapshots = {s.id: s for s in self.snapshots()}
+        for i in self.__runners_sorted():
+            s = snapshots[self.__runners[i].id]
+            if s.id != target.id and s.id not in self.__busy and s.status == Status.ON and not s.leader and \
+                    self.__hosts.same_host(s.id, target.id):
+                return self.__runners[i] if s.height > target.snapshot().height else None
+        return None
+
+    def __recover(self, r):
+        """Restart a runner, from a copy of the best runner's storage if possible
+        """
+        if not config.get('clone_storage', False):
+            r.restart()
+            return
+
+        # the source runner is suspended during the copy, which has to finish before the next event
+        max_suspend = config.get('clone_max_suspend', 60)
+        src = self.__clone_source(r)
+        now = time()
+        if src is None or self.schedule().free_gap(now, max_suspend + config['event_action']) != now:
+            r.restart()
+            return
+
+        logger.info(f'Recovering Jormungandr runner {r.id} from a copy of runner {src.id} storage')
+        self.__busy |= {r.id, src.id}
+        self.__cloner.submit(self.__clone, src, r, monotonic() + max_suspend)
+
+    def __clone(self, src, dst, deadline):
+        """Replace storage of the dst runner by a copy of the src runner's storage and restart it
+        """
+        try:
+            dst.stop()
+            self.__hosts.discard_storage_copy(dst.id)
+            src.suspend()
+            try:
+                self.__hosts.copy_storage(src.id, dst.id, deadline)
+            finally:
+                src.resume()
+
+            self.__hosts.swap_storage(dst.id)
+            logger.info(f'Storage of Jormungandr runner {src.id} copied to runner {dst.id}')
+        except Exception as e:
+            logger.error(f'Cannot copy storage of Jormungandr runner {src.id} to runner {dst.id} ({e}), '
+                         f'bootstrapping from its own storage')
+            try:
+                self.__hosts.discard_storage_copy(dst.id)
+            except Exception:
+                pass
+        finally:
+            dst.restart()
+            self.__busy -= {src.id, dst.id}
+            self.__next_probe[src.id] = self.__next_probe[dst.id] = 0
+            if self.on_clone_done is not None:
+                self.on_clone_done()
 
     # def start_if_possible(self):
     #     """ Start the rest of the runners if we know for sure there is enough time.
@@ -513,37 +2577,194 @@ class Master:
     #                 r.restart()
 
 
-def main():
-    master = Master(cnt_runners=config['cnt_runners'])
-    pooltool = PoolTool()
+def control_loop(master, pooltool, scheduler):
+    """Schedule the tasks of the master's control loop, they are run by the scheduler
+
+    Duration of each phase is recorded in metrics
+    """
+    def phase(name):
+        return metrics.timer('jorm_phase_seconds', phase=name)
+
+    def probe():
+        # Take new snapshots of runners, which are due, and react immediately on any change
+        with phase('probe'), budget(master.budget()):
+            changed = master.probe()
+        if changed:
+            scheduler.schedule_in('decide', 0, decide)
+            # Report max height to PoolTool, sent in the background
+            with phase('pooltool'):
+                pooltool.send_height(max(master.heights()))
+        scheduler.schedule('probe', master.next_probe(), probe)
+
+    def events():
+        # Handle near events, wakes up right before an event and when it has passed
+        with phase('handle_near_events'):
+            master.handle_near_events()
+        event_check = master.next_event_check()
+        if event_check is not None:
+            scheduler.schedule_at('events', max(event_check, time()), events)
+        else:
+            scheduler.cancel('events')
+
+    def decide():
+        with phase('decide'):
+            # Start all runners, that are stopped
+            with phase('start_stopped_runners'):
+                master.start_stopped_runners()
+
+            with budget(master.budget()):
+                # Check the state restored on startup
+                if not master.state_verified():
+                    with phase('verify_state'):
+                        master.verify_state()
+
+                # Load genesis settings
+                if not master.settings_loaded():
+                    with phase('load_settings'):
+                        master.load_settings()
+
+                # Get leader events
+                if not master.events_known():
+                    with phase('load_leader_events'):
+                        master.load_leader_events()
+
+            # Handle near events
+            events()
+
+            # Make sure there is exactly one best behaving leader if possible
+            with phase('best_leader'):
+                master.best_leader()
+
+            # Restart stuck runners, majority max is cached by the PoolTool client
+            with phase('pooltool'):
+                pt_max, pt_age = pooltool.majority_max()
+            with phase('restart_stuck'):
+                master.restart_stuck(pt_max, pt_age)
+
+            # Stop runners over the standby pool, and drained runners
+            with phase('trim_standby'):
+                master.trim_standby()
+                master.stop_drained()
+
+        next_decide = time() + config.get('probe_interval', 3)
+        next_start = master.next_start()
+        scheduler.schedule_at('decide', min(next_decide, max(next_start or next_decide, time())), decide)
+
+    def save_state():
+        master.save_state()
+        tracer.flush()
+        scheduler.schedule_in('state', 60, save_state)
+
+    # probe the runners of a finished storage copy right away, they are skipped while busy
+    master.on_clone_done = lambda: scheduler.schedule_in('probe', 0, probe)
+    scheduler.schedule_in('probe', 0, probe)
+    scheduler.schedule_in('decide', 0, decide)
+    scheduler.schedule_in('state', 60, save_state)
+
+
+class StatusApi:
+    """HTTP API with the master's view of the cluster, answered from memory without requests to the runners
+
+    GET /status returns everything, /runners, /schedule and /decisions its parts. Manual interventions
+    POST /runners/{id}/{drain|undrain|prefer|unprefer} need the token and are run by the control loop,
+    so they follow the same rules as the master's own decisions. Without a token the actions are disabled.
+    """
+    ACTIONS = ('drain', 'undrain', 'prefer', 'unprefer')
+
+    def __init__(self, master, pooltool, scheduler, token=None):
+        self.__master = master
+        self.__pooltool = pooltool
+        self.__scheduler = scheduler
+        self.__token = token
+
+    def status(self):
+        res = self.__master.status()
+        majority_max, age = self.__pooltool.majority_max(traced=False)
+        res['pooltool'] = {'majority_max': majority_max, 'age': age}
+        res['decisions'] = [{'time': t, 'action': action, 'runner': id} for t, action, id in list(decisions)]
+        return res
 
-    while True:
-        # Start all runners, that are stopped
-        master.start_stopped_runners()
+    def request(self, method, path, auth):
+        """Handle a request, return tuple (HTTP code, JSON payload)
+        """
+        parts = urlsplit(path).path.strip('/').split('/')
+        if method == 'GET' and len(parts) == 1 and parts[0] in ['status', 'runners', 'schedule', 'decisions']:
+            res = self.status()
+            return 200, res if parts[0] == 'status' else res[parts[0]]
+
+        if method != 'POST' or len(parts) != 3 or parts[0] != 'runners' or parts[2] not in self.ACTIONS:
+            return 404, {'error': 'not found'}
+        if not self.__token:
+            return 403, {'error': 'actions are disabled, api_token is not set'}
+        if not hmac.compare_digest(auth or '', f'Bearer {self.__token}'):
+            return 401, {'error': 'unauthorized'}
+        try:
+            id = int(parts[1])
+        except ValueError:
+            return 400, {'error': f'invalid runner id {parts[1]}'}
+        if id not in [r['id'] for r in self.__master.status()['runners']]:
+            return 404, {'error': f'Jormungandr runner {id} is not managed by the master'}
+
+        action = parts[2]
+        func = {'drain': lambda: self.__master.drain(id),
+                'undrain': lambda: self.__master.drain(id, False),
+                'prefer': lambda: self.__master.prefer(id),
+                'unprefer': lambda: self.__master.prefer(None)}[action]
+        decisions.append((time(), f'api {action}', id))
+        self.__scheduler.schedule_in(f'api_{action}_{id}', 0, func)
+        return 202, {}
+
+    def serve(self, host, port):
+        """Serve the API on http://host:port from a background thread
+        """
+        api = self
 
-        # Load genesis settings
-        if not master.settings_loaded():
-            master.load_settings()
+        class Handler(BaseHTTPRequestHandler):
+            def __handle(self, method):
+                code, payload = api.request(method, self.path, self.headers.get('Authorization'))
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
 
-        # Get leader events
-        if not master.events_known():
-            master.load_leader_events()
+            def do_GET(self):
+                self.__handle('GET')
 
-        # Handle near events:
-        master.handle_near_events()
+            def do_POST(self):
+                self.__handle('POST')
 
-        # Make sure there is exactly one best behaving leader if possible
-        master.best_leader()
+            def log_message(self, format, *args):
+                pass
 
-        # Restart stuck runners
-        pt_max = pooltool.majority_max()
-        master.restart_stuck(pt_max)
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, name='jorm_api', daemon=True).start()
+        return server
 
-        # Report max height to PoolTool
-        pooltool.send_height(max(master.heights()))
 
-        # Wait before next cycle
-        sleep(3)
+def main():
+    # systemd stops the master by SIGTERM, exit cleanly so the trace is finished
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if config.get('trace_file'):
+        tracer.open(config['trace_file'])
+        atexit.register(tracer.flush)
+    if config.get('metrics_listen'):
+        host, port = config['metrics_listen'].rsplit(':', 1)
+        metrics.serve(host, int(port))
+    master = Master(cnt_runners=config.get('cnt_runners', 0), state_file=config.get('state_file'))
+    pooltool = PoolTool()
+    pooltool.start()
+    peers = PeerHeights(reference_config('peers', []))
+    peers.start()
+    master.reference.add_source('peers', peers.samples, reference_config('trust', {}).get('peers', 0.9))
+    scheduler = Scheduler()
+    control_loop(master, pooltool, scheduler)
+    if config.get('api_listen'):
+        host, port = config['api_listen'].rsplit(':', 1)
+        StatusApi(master, pooltool, scheduler, config.get('api_token')).serve(host, int(port))
+    scheduler.run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+# Offline replay of the master's decisions against traces recorded by the master (trace_file in the config)
+#
+# The master runs on a simulated clock, faster than real time. REST responses, unit states and PoolTool values
+# are the last ones recorded before the current time of the replay. Actions of the replay don't change the inputs,
+# so the replay shows what the master would decide with the same inputs, e.g. after a change of the policy
+# or the configuration. The decisions are compared with the recorded ones.
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import tempfile
+import yaml
+import requests
+from time import monotonic
+from bisect import bisect_right
+from datetime import datetime
+
+jm = None  # the jorm_master module, imported by main() once the configuration path is known
+
+
+class Trace:
+    """Recorded inputs indexed by time, and the recorded actions of the master
+    """
+    def __init__(self, paths, lookahead=0.1):
+        self.lookahead = lookahead  # tolerated delay of the recorded requests, e.g. by scheduling
+        self.start = self.end = None
+        self.actions = []   # list of (time, action)
+        self.__inputs = {}  # (kind, key) -> ([times], [values])
+        for path in paths:
+            with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path, 'r')) as f:
+                try:
+                    for line in f:
+                        try:
+                            t, kind, key, value = json.loads(line)
+                        except ValueError:
+                            continue  # e.g. the last line of a trace, which was being written
+                        self.__add(t, kind, key, value)
+                except (EOFError, OSError) as e:
+                    # the last gzip member is unfinished, e.g. the master was killed, keep the lines read so far
+                    print(f'{path}: {e}, the rest of the trace is skipped', file=sys.stderr)
+        for times, values in self.__inputs.values():
+            order = sorted(range(len(times)), key=times.__getitem__)
+            times[:], values[:] = [times[i] for i in order], [values[i] for i in order]
+        self.actions.sort()
+
+    def __add(self, t, kind, key, value):
+        self.start = t if self.start is None else min(self.start, t)
+        self.end = t if self.end is None else max(self.end, t)
+        if kind == 'action':
+            self.actions.append((t, key))
+            return
+        if kind == 'http' and not key.startswith('GET '):
+            self.actions.append((t, key))
+        times, values = self.__inputs.setdefault((kind, key), ([], []))
+        times.append(t)
+        values.append(value)
+
+    def lookup(self, kind, key, t):
+        """Return the last value recorded at or before t (plus the lookahead), or None
+        """
+        t += self.lookahead
+        times, values = self.__inputs.get((kind, key), ([], []))
+        i = bisect_right(times, t) - 1
+        return values[i] if i >= 0 else None
+
+
+class ReplayClock:
+    """Simulated wall and monotonic clock, advanced by the replay
+    """
+    def __init__(self, start):
+        self.__wall = start
+        self.__base = start - 1e6  # monotonic time is large and positive, as on a long running host
+
+    def time(self):
+        return self.__wall
+
+    def monotonic(self):
+        return self.__wall - self.__base
+
+    def advance(self, seconds):
+        self.__wall += max(seconds, 0)
+
+
+class ReplayResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f'{self.status_code}')
+
+
+class ReplaySession:
+    """HTTP session answering from the trace, actions which weren't recorded succeed
+    """
+    ERRORS = {'Timeout': requests.exceptions.Timeout, 'ReadTimeout': requests.exceptions.ReadTimeout,
+              'ConnectTimeout': requests.exceptions.ConnectTimeout}
+
+    def __init__(self, trace, clock, decisions):
+        self.__trace = trace
+        self.__clock = clock
+        self.__decisions = decisions
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def request(self, method, url, **kwargs):
+        key = f'{method} {url}'
+        if method != 'GET':
+            self.__decisions.append((self.__clock.time(), key))
+        value = self.__trace.lookup('http', key, self.__clock.time())
+        if value is None and method == 'GET':
+            raise requests.exceptions.ConnectionError(f'{key} is not in the trace')
+        if value is None or (method == 'DELETE' and value[0] == 404):
+            # a recorded 404 was about a leader id of the recording, not of the replay
+            value = [200, '1' if method == 'POST' else '']
+        if value[0] == 'error':
+            if value[1] == 'BudgetExceeded':
+                raise jm.BudgetExceeded(key)
+            raise self.ERRORS.get(value[1], requests.exceptions.ConnectionError)(key)
+        return ReplayResponse(*value)
+
+
+class ReplaySystemd:
+    """Systemd backend with unit states from the trace, actions are collected as decisions
+    """
+    def __init__(self, trace, clock, decisions):
+        self.__trace = trace
+        self.__clock = clock
+        self.__decisions = decisions
+
+    def units(self, ids):
+        res = {}
+        for id in ids:
+            value = self.__trace.lookup('unit', id, self.__clock.time())
+            if value is None:
+                res[id] = jm.UNKNOWN_UNIT
+            else:
+                state, uptime = value
+                res[id] = jm.Unit(state, self.__clock.monotonic() - uptime if uptime else 0)
+        return res
+
+    def restart(self, id):
+        self.__decisions.append((self.__clock.time(), f'restart {id}'))
+
+    def stop(self, id):
+        self.__decisions.append((self.__clock.time(), f'stop {id}'))
+
+    def kill(self, id, sig):
+        self.__decisions.append((self.__clock.time(), f'kill {id}'))
+
+
+class ReplayPoolTool:
+    def __init__(self, trace, clock):
+        self.__trace = trace
+        self.__clock = clock
+
+    def send_height(self, height):
+        pass
+
+    def majority_max(self):
+        value = self.__trace.lookup('pooltool', None, self.__clock.time())
+        return tuple(value) if value is not None else (0, None)
+
+
+def replay(trace):
+    """Run the master's control loop over the whole trace, return list of (time, action) decisions
+    """
+    clock = ReplayClock(trace.start)
+    decisions = []
+    jm.use_clock(clock.time, clock.monotonic)
+    jm.session_factory = lambda: ReplaySession(trace, clock, decisions)
+
+    master = jm.Master(cnt_runners=jm.config.get('cnt_runners', 0), systemd=ReplaySystemd(trace, clock, decisions))
+    scheduler = jm.Scheduler(clock=clock.monotonic)
+    jm.control_loop(master, ReplayPoolTool(trace, clock), scheduler)
+    while clock.time() < trace.end:
+        if scheduler.run_once(block=False):
+            continue
+        deadline = scheduler.next_deadline()
+        if deadline is None:
+            break
+        clock.advance(min(deadline - clock.monotonic(), trace.end - clock.time()) + 1e-3)
+    return decisions
+
+
+def normalize(actions, runners):
+    """Return list of (time, action) with REST requests replaced by 'promote N' and 'demote N'
+
+    Leader ids in the URLs of demotions differ between the recording and the replay. runners is a dict
+    of REST API prefix -> runner id.
+    """
+    res = []
+    for t, action in actions:
+        method, _, url = action.partition(' ')
+        for rest, id in runners.items():
+            if method == 'POST' and url == f'{rest}/api/v0/leaders':
+                action = f'promote {id}'
+            elif method == 'DELETE' and url.startswith(f'{rest}/api/v0/leaders/'):
+                action = f'demote {id}'
+        res.append((t, action))
+    return res
+
+
+def compare(recorded, replayed, tolerance):
+    """Match the same actions within the tolerance in seconds, return lists of unmatched recorded and replayed ones
+    """
+    unmatched = list(replayed)
+    missing = []
+    for t, action in recorded:
+        match = next((d for d in unmatched if d[1] == action and abs(d[0] - t) <= tolerance), None)
+        if match is None:
+            missing.append((t, action))
+        else:
+            unmatched.remove(match)
+    return missing, unmatched
+
+
+def main():
+    global jm
+    parser = argparse.ArgumentParser(description='Replay the master\'s decisions against recorded traces')
+    parser.add_argument('traces', nargs='+', help='trace files recorded by the master')
+    parser.add_argument('--config', help='configuration of the master for the replay (default as the master)')
+    parser.add_argument('--tolerance', type=float, default=10, help='time tolerance of matching actions, in seconds')
+    parser.add_argument('--lookahead', type=float, default=0.1,
+                        help='tolerated delay of the recorded requests behind the replay, in seconds')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log the master to stderr')
+    args = parser.parse_args()
+
+    if args.config:
+        os.environ['JORM_MASTER_CONFIG'] = args.config
+    import jorm_master
+    jm = jorm_master
+    jm.logger.setLevel(logging.INFO if args.verbose else logging.ERROR)
+    # nothing is changed outside of the replay, runners of all hosts are replayed as local ones
+    jm.config.update(state_file=None, clone_storage=False, trace_file='')
+    if jm.config.get('runners'):
+        jm.config['runners'] = [dict(r, agent=None) for r in jm.config['runners']]
+    if not os.path.exists(jm.config['node_secret']):
+        jm.config['node_secret'] = os.path.join(tempfile.mkdtemp(prefix='jorm_replay_'), 'node_secret.yaml')
+        with open(jm.config['node_secret'], 'w') as f:
+            yaml.safe_dump({'genesis': {'sig_key': 'replay', 'node_id': 'replay'}}, f)
+
+    trace = Trace(args.traces, args.lookahead)
+    if trace.start is None:
+        print('The traces are empty')
+        return 1
+    started = monotonic()
+    decisions = replay(trace)
+    runners = {r.rest: r.id for r in jm.runner_configs(jm.config.get('cnt_runners', 0))}
+    missing, extra = compare(normalize(trace.actions, runners), normalize(decisions, runners), args.tolerance)
+
+    print(f'Replayed {trace.end - trace.start:.0f} s of traces in {monotonic() - started:.1f} s')
+    print(f'Actions recorded: {len(trace.actions)}, replayed: {len(decisions)}, '
+          f'only recorded: {len(missing)}, only replayed: {len(extra)}')
+    for t, action in sorted([(t, f'- {a}') for t, a in missing] + [(t, f'+ {a}') for t, a in extra]):
+        print(f'{datetime.fromtimestamp(t)} {action}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
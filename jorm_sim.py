@@ -0,0 +1,623 @@
+#!/usr/bin/env python3
+
+# Simulated cluster of Jormungandr runners for exercising and benchmarking the jorm_master control loop
+#
+# REST APIs of the runners, systemd and PoolTool are replaced by local fakes with scriptable latency, stalls,
+# crashes and bootstrap durations. The master itself runs unchanged in this process.
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import signal
+import sys
+import tempfile
+import yaml
+from time import sleep, time, monotonic
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Event, Thread
+
+jm = None  # the jorm_master module, imported by load_master() once the configuration is written
+
+# Overrides of jorm_master.yaml for simulations, all times are scaled down to seconds
+SIM_CONFIG = {
+    'state_file': None,
+    'rest_prefix': 420,
+    'leader_check': 30,
+    'probe_interval': 1,
+    'probe_leader': 0.5,
+    'probe_event': 0.5,
+    'probe_boot': 1,
+    'probe_max': 3,
+    'probe_idle_gap': 10,
+    'probe_slot_offset': 0.2,
+    'probe_stats': 10,
+    'max_offset': 5,
+    'max_boot': 30,
+    'event_action': 2,
+    'start_before_event': 5,
+    'boot_catch_up': 2,
+    'stall_time': 3,
+    'stall_window': 20,
+    'clone_storage': False,
+    'http': {'connect_timeout': 0.5, 'read_timeout': 1, 'cycle_budget': 2, 'event_budget': 0.5},
+}
+
+
+def iso_time(t):
+    """Return unix time in the Jormungandr format, e.g. '2019-12-13T19:13:37+00:00'
+    """
+    return datetime.fromtimestamp(int(t), timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+
+class Chain:
+    """Blockchain with a block every block_time seconds (one per slot by default), and leader events of the pool
+    """
+    def __init__(self, slot_duration=1, slots_per_epoch=86400, block_time=None):
+        self.slot_duration = slot_duration
+        self.slots_per_epoch = slots_per_epoch
+        self.block_time = block_time or slot_duration
+        self.block0_time = int(time()) - 60 * slot_duration
+        self.events = []  # unix times of the pool's leader events
+
+    def height(self, t=None):
+        return int(((time() if t is None else t) - self.block0_time) / self.block_time)
+
+    @staticmethod
+    def tip(height):
+        return f'{height:064x}'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Pass HTTP requests to the request() method of the server's app, None closes the connection unanswered
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are sent separately, don't wait for delayed ACKs
+
+    def log_message(self, format, *args):
+        pass
+
+    def __handle(self, method):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        res = self.server.app.request(method, self.path, body)
+        if res is None:
+            self.close_connection = True
+            return
+        code, payload = res
+        text = isinstance(payload, bytes)  # plain text, e.g. the tip hash
+        data = payload if text else json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain' if text else 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.__handle('GET')
+
+    def do_POST(self):
+        self.__handle('POST')
+
+    def do_DELETE(self):
+        self.__handle('DELETE')
+
+
+def serve(app, port):
+    """Start a HTTP server of the app in a background thread
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.app = app
+    Thread(target=server.serve_forever, name=f'sim_http_{port}', daemon=True).start()
+    return server
+
+
+class SimNode:
+    """Simulated Jormungandr runner serving the REST API used by the master
+
+    latency, boot_duration and lag (blocks behind the chain) can be changed at any time.
+    """
+    def __init__(self, id, chain, port, start_as_leader=True):
+        self.id = id
+        self.port = port
+        self.latency = 0.0
+        self.boot_duration = 2.0
+        self.lag = 0
+        self.start_as_leader = start_as_leader  # jorm_runner.sh passes the node secret to the runner
+        self.requests = 0
+        self.stats_requests = 0  # of them full node stats
+        self.__chain = chain
+        self.__lock = Lock()
+        self.__started = None      # monotonic time of the start, None if not running
+        self.__exit_state = 'inactive'
+        self.__stalled_at = None   # height, at which the tip stopped moving
+        self.__leaders = []
+        self.__next_leader_id = 1
+        self.__resumed = Event()   # cleared while suspended
+        self.__resumed.set()
+        self.__server = None
+
+    def listen(self):
+        self.__server = serve(self, self.port)
+
+    def shutdown(self):
+        self.__resumed.set()
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+
+    def unit(self):
+        """Return state of the node's systemd unit
+        """
+        with self.__lock:
+            return jm.Unit('active', self.__started) if self.__started is not None else jm.Unit(self.__exit_state, 0)
+
+    def start(self):
+        with self.__lock:
+            self.__started = monotonic()
+            self.__stalled_at = None
+            self.__leaders = [self.__new_leader_id()] if self.start_as_leader else []
+            self.__resumed.set()
+
+    def stop(self, exit_state='inactive'):
+        with self.__lock:
+            self.__started = None
+            self.__exit_state = exit_state
+            self.__leaders = []
+            self.__resumed.set()
+
+    def crash(self):
+        self.stop('failed')
+
+    def stall(self):
+        """Stop the tip at the current height, until the node is restarted
+        """
+        with self.__lock:
+            self.__stalled_at = self.__height()
+
+    def suspend(self):
+        self.__resumed.clear()
+
+    def resume(self):
+        self.__resumed.set()
+
+    def __new_leader_id(self):
+        self.__next_leader_id += 1
+        return self.__next_leader_id - 1
+
+    def __state(self):
+        if self.__started is None:
+            return None
+        return 'Running' if monotonic() - self.__started >= self.boot_duration else 'Bootstrapping'
+
+    def __height(self):
+        height = self.__chain.height() - self.lag
+        return height if self.__stalled_at is None else min(height, self.__stalled_at)
+
+    def producing(self):
+        """Can the node create a block right now?
+        """
+        with self.__lock:
+            return (self.__state() == 'Running' and self.__resumed.is_set() and bool(self.__leaders)
+                    and self.__stalled_at is None)
+
+    def running(self):
+        with self.__lock:
+            return self.__state() == 'Running' and self.__stalled_at is None
+
+    def request(self, method, path, body):
+        """Answer a REST request, return tuple (HTTP code, JSON payload), or None if the node is down
+        """
+        with self.__lock:
+            self.requests += 1
+            self.stats_requests += path == '/api/v0/node/stats'
+        self.__resumed.wait(60)  # a suspended process doesn't answer
+        if self.latency:
+            sleep(self.latency)
+
+        with self.__lock:
+            state = self.__state()
+            if state is None:
+                return None
+
+            if method == 'GET' and path == '/api/v0/node/stats':
+                if state != 'Running':
+                    return 200, {'state': state, 'lastBlockHeight': None, 'lastBlockHash': None, 'uptime': None}
+                height = self.__height()
+                return 200, {'state': state, 'lastBlockHeight': str(height), 'lastBlockHash': self.__chain.tip(height),
+                             'uptime': int(monotonic() - self.__started)}
+            if method == 'GET' and path == '/api/v0/tip':
+                return 200, self.__chain.tip(self.__height() if state == 'Running' else 0).encode('utf-8')
+            if method == 'GET' and path == '/api/v0/settings':
+                return 200, {'block0Time': iso_time(self.__chain.block0_time),
+                             'slotDuration': self.__chain.slot_duration,
+                             'slotsPerEpoch': self.__chain.slots_per_epoch}
+            if method == 'GET' and path == '/api/v0/leaders':
+                return 200, list(self.__leaders)
+            if method == 'POST' and path == '/api/v0/leaders':
+                json.loads(body)
+                leader_id = self.__new_leader_id()
+                self.__leaders.append(leader_id)
+                return 201, leader_id
+            if method == 'DELETE' and path.startswith('/api/v0/leaders/'):
+                leader_id = int(path.rsplit('/', 1)[1])
+                if leader_id not in self.__leaders:
+                    return 404, None
+                self.__leaders.remove(leader_id)
+                return 200, None
+            if method == 'GET' and path == '/api/v0/leaders/logs':
+                return 200, [{'created_at_time': iso_time(self.__chain.block0_time),
+                              'scheduled_at_time': iso_time(e),
+                              'scheduled_at_date': f'0.{int((e - self.__chain.block0_time) / self.__chain.slot_duration)}',
+                              'wake_at_time': None, 'finished_at_time': None, 'status': 'Pending',
+                              'enclave_leader_id': 1} for e in self.__chain.events]
+            return 404, None
+
+
+class SimSystemd:
+    """Systemd backend controlling the simulated nodes, calls are recorded as (monotonic time, action, id)
+    """
+    def __init__(self, nodes):
+        self.latency = 0.0
+        self.calls = []
+        self.__nodes = {n.id: n for n in nodes}
+
+    def __call(self, action, id):
+        self.calls.append((monotonic(), action, id))
+        if self.latency:
+            sleep(self.latency)
+
+    def units(self, ids):
+        self.__call('units', None)
+        return {id: self.__nodes[id].unit() if id in self.__nodes else jm.Unit('inactive', 0) for id in ids}
+
+    def restart(self, id):
+        self.__call('restart', id)
+        self.__nodes[id].start()
+
+    def stop(self, id):
+        self.__call('stop', id)
+        self.__nodes[id].stop()
+
+    def kill(self, id, sig):
+        self.__call('kill', id)
+        if sig == signal.SIGSTOP:
+            self.__nodes[id].suspend()
+        elif sig == signal.SIGCONT:
+            self.__nodes[id].resume()
+        else:
+            self.__nodes[id].crash()
+
+
+class SimPoolTool:
+    """Simulated PoolTool serving the majority max of the chain, and accepting reported heights
+    """
+    def __init__(self, chain):
+        self.latency = 0.0
+        self.available = True
+        self.heights = []
+        self.__chain = chain
+        self.__server = serve(self, 0)
+        self.port = self.__server.server_address[1]
+
+    def request(self, method, path, body):
+        if self.latency:
+            sleep(self.latency)
+        if not self.available:
+            return 503, None
+        if path.startswith('/stats'):
+            return 200, {'majoritymax': self.__chain.height()}
+        if path.startswith('/sharemytip'):
+            self.heights.append(int(path.rsplit('=', 1)[1]))
+            return 200, {'success': True}
+        return 404, None
+
+
+class Cluster:
+    """Simulated runners with a monitor, which evaluates every leader event and periods without a leader
+    """
+    def __init__(self, cnt, chain):
+        self.chain = chain
+        self.nodes = [SimNode(i, chain, int(f'{jm.config["rest_prefix"]}{i}')) for i in range(cnt)]
+        self.systemd = SimSystemd(self.nodes)
+        self.missed = []    # leader events without a producing node
+        self.forks = []     # leader events with more than one producing node
+        self.leaderless = []  # list of (start, end) unix times without a producing node, after the first leader
+        self.__stop = Event()
+        self.__thread = Thread(target=self.__watch, name='sim_monitor', daemon=True)
+
+    def start(self):
+        for n in self.nodes:
+            n.listen()
+        self.__thread.start()
+
+    def shutdown(self):
+        self.__stop.set()
+        self.__thread.join()
+        for n in self.nodes:
+            n.shutdown()
+
+    def rest_calls(self):
+        return sum(n.requests for n in self.nodes)
+
+    def stats_calls(self):
+        return sum(n.stats_requests for n in self.nodes)
+
+    def producing(self):
+        return [n for n in self.nodes if n.producing()]
+
+    def __watch(self, step=0.01):
+        pending = sorted(e for e in self.chain.events if e > time())
+        since = None  # start of the current period without a leader
+        seen = False
+        while not self.__stop.wait(step):
+            now = time()
+            producing = self.producing()
+            while pending and pending[0] <= now:
+                e = pending.pop(0)
+                if not producing:
+                    self.missed.append(e)
+                elif len(producing) > 1:
+                    self.forks.append(e)
+            if producing:
+                if since is not None:
+                    self.leaderless.append((since, now))
+                seen, since = True, None
+            elif seen and since is None:
+                since = now
+
+
+def load_master(pooltool_port, verbose=False):
+    """Write configuration for simulations and import jorm_master with it
+    """
+    global jm
+    base = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jorm_master.yaml')
+    with open(base, 'r') as f:
+        config = yaml.safe_load(f)
+    config.update(SIM_CONFIG)
+    tmp = tempfile.mkdtemp(prefix='jorm_sim_')
+    config['node_secret'] = os.path.join(tmp, 'node_secret.yaml')
+    with open(config['node_secret'], 'w') as f:
+        yaml.safe_dump({'genesis': {'sig_key': 'kes25519-12-sk1sim', 'node_id': 'sim'}}, f)
+    config['pooltool'].update({
+        'endp_tip': f'http://127.0.0.1:{pooltool_port}/sharemytip',
+        'endp_stats': f'http://127.0.0.1:{pooltool_port}/stats/stats.json',
+        'send_wait': 1, 'recv_wait': 1, 'timeout': 1, 'max_backoff': 4,
+    })
+    path = os.path.join(tmp, 'jorm_master.yaml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+
+    os.environ['JORM_MASTER_CONFIG'] = path
+    jm = importlib.import_module('jorm_master')
+    jm.logger.setLevel(logging.INFO if verbose else logging.ERROR)
+    return jm
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] if values else float('nan')
+
+
+def benchmark(cnt, chain, duration=60, latency=0.0, boot=2.0, agents=0):
+    """Run the master against a simulated cluster of cnt runners and return dict of measurements
+
+    With agents, the runners are spread over that many jorm_agent.py agents, as if they were on multiple hosts.
+
+    Scenario: cold start, leader events every 15 s from 12 s, a follower stalls at 16 s, the leader crashes at 33 s.
+    """
+    start = time()
+    chain.events = list(range(int(start) + 12, int(start + duration), 15))
+    cluster = Cluster(cnt, chain)
+    for n in cluster.nodes:
+        n.latency, n.boot_duration = latency, boot
+    cluster.start()
+
+    servers = []
+    if agents:
+        import jorm_agent
+        logging.getLogger('jorm_agent').setLevel(jm.logger.level)
+        servers = [jorm_agent.serve(jorm_agent.Agent(range(i, cnt, agents), cluster.systemd), '127.0.0.1', 0,
+                                    background=True) for i in range(agents)]
+        jm.config['runners'] = [{'host': '127.0.0.1', 'port': n.port,
+                                 'agent': f'http://127.0.0.1:{servers[n.id % agents].server_address[1]}'}
+                                for n in cluster.nodes]
+    master = jm.Master(cnt_runners=cnt, systemd=None if agents else cluster.systemd)
+    jm.config.pop('runners', None)
+    pooltool = jm.PoolTool()
+    pooltool.start()
+    scheduler = jm.Scheduler()
+    jm.control_loop(master, pooltool, scheduler)
+
+    # time the probes and the decisions, a decision starts with starting stopped runners and ends with stuck ones
+    timings = {'probe': [], 'decide': []}
+    decide_start = [None]
+
+    def timed(name, first=False, last=False):
+        func = getattr(master, name)
+
+        def call(*args, **kwargs):
+            t = monotonic()
+            if first:
+                decide_start[0] = t
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if name in timings:
+                    timings[name].append(monotonic() - t)
+                if last and decide_start[0] is not None:
+                    timings['decide'].append(monotonic() - decide_start[0])
+        setattr(master, name, call)
+
+    timed('probe')
+    timed('start_stopped_runners', first=True)
+    timed('restart_stuck', last=True)
+
+    marks = {}
+
+    def stall():
+        followers = [n for n in cluster.nodes if n.running() and not n.producing()]
+        if followers:
+            followers[0].stall()
+            marks['stall'] = (followers[0].id, monotonic())
+
+    def crash():
+        leaders = cluster.producing()
+        if leaders:
+            leaders[0].crash()
+            marks['crash'] = (leaders[0].id, time())
+
+    done = Event()
+    scheduler.schedule_in('sim_stall', 16, stall)
+    scheduler.schedule_in('sim_crash', 33, crash)
+    scheduler.schedule_in('sim_end', duration, done.set)
+    rest_start, stats_start = cluster.rest_calls(), cluster.stats_calls()
+    while not done.is_set():
+        scheduler.run_once()
+    rest_calls = cluster.rest_calls() - rest_start
+    stats_calls = cluster.stats_calls() - stats_start
+    cluster.shutdown()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+    res = {'runners': cnt, 'timings': timings, 'rest_per_cycle': rest_calls / max(len(timings['decide']), 1),
+           'rest_per_second': rest_calls / duration, 'stats_per_second': stats_calls / duration,
+           'events': len(chain.events), 'missed': len(cluster.missed), 'forks': len(cluster.forks),
+           'stuck_detect': None, 'failover_gap': None}
+    if 'stall' in marks:
+        id, t = marks['stall']
+        restarts = [c[0] for c in cluster.systemd.calls if c[1:] == ('restart', id) and c[0] >= t]
+        res['stuck_detect'] = restarts[0] - t if restarts else None
+    if 'crash' in marks:
+        _, t = marks['crash']
+        gaps = [end - begin for begin, end in cluster.leaderless if begin >= t - 0.05]
+        res['failover_gap'] = gaps[0] if gaps else None
+    return res
+
+
+# Scenarios of the height reference: name, runner heights, PoolTool (height, age), peer heights, judged runner,
+# time since the runners' tips and the PoolTool value last moved (in multiples of stall_time), and whether
+# the judged runner should be restarted as stuck
+REFERENCE_SCENARIOS = [
+    ('lone runner behind PoolTool', {0: 1000}, (1500, 0), {}, 0, (0, 0), True),
+    ('2 of 3 runners stuck', {0: 1000, 1: 1000, 2: 1500}, (1500, 0), {}, 0, (0, 0), True),
+    ('all runners stuck, PoolTool only', {0: 1000, 1: 1000, 2: 1000}, (1500, 0), {}, 0, (5, 0.1), True),
+    ('all runners stuck, stale PoolTool', {0: 1000, 1: 1000, 2: 1000}, (1500, 3600), {}, 0, (5, 5), False),
+    ('all runners stuck, PoolTool and peer', {0: 1000, 1: 1000, 2: 1000}, (1500, 0), {'a': 1500}, 0, (5, 0.1), True),
+    ('PoolTool slightly ahead', {0: 1000, 1: 1000, 2: 1000}, (1006, 0), {}, 0, (0, 0), False),
+    ('bogus PoolTool', {0: 1000, 1: 1000, 2: 1000}, (6000, 0), {}, 0, (0, 0), False),
+    ('bogus PoolTool, peer agrees with runners', {0: 1000, 1: 1000, 2: 1000}, (6000, 0), {'a': 1000}, 0, (0, 0), False),
+    ('stale PoolTool', {0: 1000}, (1500, 3600), {}, 0, (0, 5), False),
+]
+
+
+def reference_scenarios():
+    """Print confidence of the height reference, that the judged runner is behind, for REFERENCE_SCENARIOS
+
+    The judged runner is stuck, if the confidence reaches the threshold, or the whole cluster stalled.
+
+    Return number of scenarios with an unexpected outcome.
+    """
+    threshold = jm.reference_config('confidence', 0.5)
+    trust = jm.reference_config('trust', {})
+    failed = 0
+    print(f'{"scenario":<42} {"confidence":>10} {"stuck":>5} {"expected":>8}')
+    stall_time = jm.config.get('stall_time', 120)
+    for name, runners, pooltool, peers, judged, (runners_idle, pooltool_idle), expected in REFERENCE_SCENARIOS:
+        reference = jm.HeightReference(jm.reference_config('half_life', 60), jm.reference_config('outlier', 100))
+        reference.add_source('runners', lambda: {id: (h, 0) for id, h in runners.items()},
+                             trust.get('runners', 1.0), local=True)
+        reference.add_source('pooltool', lambda: {None: pooltool}, trust.get('pooltool', 0.8))
+        reference.add_source('peers', lambda: {peer: (h, 0) for peer, h in peers.items()}, trust.get('peers', 0.9))
+        reference.update()
+        confidence = reference.behind(runners[judged], exclude=('runners', judged))
+        # runners of a cluster stalled as a whole are restarted regardless of the confidence
+        stalled = jm.cluster_stalled([runners_idle * stall_time] * len(runners), pooltool_idle * stall_time,
+                                     pooltool[0] - max(runners.values()))
+        stuck = confidence >= threshold or stalled
+        failed += stuck != expected
+        print(f'{name:<42} {confidence:>10.2f} {"yes" if stuck else "no":>5} {"yes" if expected else "no":>8}')
+    return failed
+
+
+def staggered_boots(chain, cnt=4, duration=30):
+    """Run the master against healthy runners, whose bootstraps finish 1 s apart, print unexpected restarts
+
+    Return number of runners restarted more than once (the first start is expected).
+    """
+    chain.events = []
+    cluster = Cluster(cnt, chain)
+    for n in cluster.nodes:
+        n.boot_duration = 2.0 + n.id
+    cluster.start()
+    master = jm.Master(cnt_runners=cnt, systemd=cluster.systemd)
+    pooltool = jm.PoolTool()
+    pooltool.start()
+    scheduler = jm.Scheduler()
+    jm.control_loop(master, pooltool, scheduler)
+
+    done = Event()
+    scheduler.schedule_in('sim_end', duration, done.set)
+    while not done.is_set():
+        scheduler.run_once()
+    cluster.shutdown()
+
+    restarts = {n.id: sum(1 for c in cluster.systemd.calls if c[1:] == ('restart', n.id)) for n in cluster.nodes}
+    failed = sum(1 for cnt_restarts in restarts.values() if cnt_restarts > 1)
+    print(f'staggered boots of {cnt} runners: (re)starts {restarts}, unexpected restarts: {failed}')
+    return failed
+
+
+def report(results):
+    def ms(value):
+        return f'{value * 1000:.1f}' if value is not None else '-'
+
+    def sec(value):
+        return f'{value:.1f}' if value is not None else '-'
+
+    print(f'{"runners":>7} {"decide p50/p95/max ms":>22} {"probe p50/p95 ms":>17} {"REST/cycle":>10} {"REST/s":>6} {"stats/s":>7} '
+          f'{"stuck s":>7} {"failover ms":>11} {"missed":>9} {"forks":>5}')
+    for r in results:
+        d, p = r['timings']['decide'], r['timings']['probe']
+        decide = f'{ms(percentile(d, 0.5))}/{ms(percentile(d, 0.95))}/{ms(max(d, default=None))}'
+        probe = f'{ms(percentile(p, 0.5))}/{ms(percentile(p, 0.95))}'
+        print(f'{r["runners"]:>7} {decide:>22} {probe:>17} {r["rest_per_cycle"]:>10.1f} {r["rest_per_second"]:>6.1f} '
+              f'{r["stats_per_second"]:>7.1f} {sec(r["stuck_detect"]):>7} '
+              f'{ms(r["failover_gap"]):>11} {r["missed"]:>4}/{r["events"]:<4} {r["forks"]:>5}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark jorm_master against a simulated cluster of runners')
+    parser.add_argument('--runners', type=int, nargs='+', default=[3, 10, 50], help='cluster sizes to benchmark')
+    parser.add_argument('--duration', type=int, default=60, help='duration of each run in seconds (at least 45)')
+    parser.add_argument('--latency', type=float, default=0.0, help='latency of the runners REST API in seconds')
+    parser.add_argument('--boot', type=float, default=2.0, help='bootstrap duration of the runners in seconds')
+    parser.add_argument('--block-time', type=float, default=1.0, help='average time between blocks in seconds')
+    parser.add_argument('--agents', type=int, default=0, help='spread the runners over this many agents')
+    parser.add_argument('--standby', type=int, help='keep a standby pool of this many synced passive runners')
+    parser.add_argument('--spares', type=int, help='start this many spares ahead of need, with --standby')
+    parser.add_argument('--reference', action='store_true', help='check the height reference against scenarios')
+    parser.add_argument('--staggered', action='store_true', help='check that staggered boots restart no runner')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log the master to stderr')
+    args = parser.parse_args()
+
+    chain = Chain(block_time=args.block_time)
+    pooltool = SimPoolTool(chain)
+    load_master(pooltool.port, args.verbose)
+    if args.reference:
+        return 1 if reference_scenarios() else 0
+    if args.staggered:
+        return 1 if staggered_boots(chain) else 0
+    jm.config['standby'] = args.standby
+    jm.config['spares'] = args.spares
+    results = []
+    for cnt in args.runners:
+        results.append(benchmark(cnt, chain, args.duration, args.latency, args.boot, args.agents))
+    report(results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())